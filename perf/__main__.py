@@ -10,9 +10,11 @@ import perf
 from perf._metadata import _common_metadata
 from perf._cli import (format_metadata, empty_line,
                        format_checks, format_histogram, format_title,
-                       format_benchmark, display_title)
+                       format_benchmark, display_title, format_scaling)
 from perf._formatter import format_timedelta, format_seconds, format_datetime
 from perf._cpu_utils import get_isolated_cpus, parse_cpu_list, set_cpu_affinity
+from perf._command import CommandRunner
+from perf._rerun import parse_duration
 from perf._timeit_cli import TimeitRunner
 from perf._utils import parse_run_list
 
@@ -44,6 +46,12 @@ def create_parser():
             raise argparse.ArgumentTypeError('invalid CPU list: %r' % value)
         return cpus
 
+    def strictly_positive(value):
+        value = int(value)
+        if value <= 0:
+            raise ValueError("value must be > 0")
+        return value
+
     def cpu_affinity(cmd):
         cmd.add_argument("--affinity", metavar="CPU_LIST", default=None,
                          type=parse_affinity,
@@ -110,6 +118,10 @@ def create_parser():
     cmd = subparsers.add_parser('timeit', help='Quick Python microbenchmark')
     timeit_runner = TimeitRunner(_argparser=cmd)
 
+    # command
+    cmd = subparsers.add_parser('command', help='Benchmark a command')
+    command_runner = CommandRunner(_argparser=cmd)
+
     # system
     cmd = subparsers.add_parser('system', help='System setup for benchmarks')
     cpu_affinity(cmd)
@@ -136,6 +148,9 @@ def create_parser():
     cmd.add_argument('--exclude-runs', help='Remove specified benchmark runs')
     cmd.add_argument('--remove-outliers', action='store_true',
                      help='Remove outlier runs')
+    cmd.add_argument('--remove-outlier-processes', action='store_true',
+                     help='Remove runs flagged as outlier processes '
+                          'by Runner --detect-outliers')
     cmd.add_argument('--indent', action='store_true',
                      help='Indent JSON (rather using compact JSON)')
     cmd.add_argument('--remove-warmups', action='store_true',
@@ -167,7 +182,28 @@ def create_parser():
                      help='Number of slow benchmarks to display (default: 5)')
     input_filenames(cmd, name=False)
 
-    return parser, timeit_runner
+    # rerun
+    cmd = subparsers.add_parser('rerun',
+                                help='Run more workers of unstable '
+                                     'benchmarks')
+    cmd.add_argument('--budget', metavar='DURATION', required=True,
+                     type=parse_duration,
+                     help='Wall-clock time budget: number of seconds, or '
+                          'a number followed by s, m or h (ex: 10m)')
+    cmd.add_argument('-p', '--processes', type=strictly_positive, default=5,
+                     help='Maximum number of processes added to a '
+                          'benchmark at each step (default: 5)')
+    cmd.add_argument('--python', default=sys.executable,
+                     help='Python executable (default: use running Python)')
+    cmd.add_argument('-o', '--output', metavar='FILENAME',
+                     help='Write the updated benchmark suite into FILENAME '
+                          '(default: update the input file)')
+    cmd.add_argument('filename', metavar='file.json',
+                     help='Benchmark file')
+    cmd.add_argument('script', nargs=argparse.REMAINDER,
+                     help='Benchmark script and its arguments')
+
+    return parser, timeit_runner, command_runner
 
 
 DataItem = collections.namedtuple('DataItem',
@@ -389,7 +425,8 @@ def cmd_collect_metadata(args):
 
 def display_benchmarks(args, show_metadata=False, hist=False, stats=False,
                        dump=False, result=False, checks=False,
-                       display_runs_args=None, only_checks=False):
+                       display_runs_args=None, only_checks=False,
+                       scaling=False):
     data = load_benchmarks(args)
 
     output = []
@@ -496,6 +533,14 @@ def display_benchmarks(args, show_metadata=False, hist=False, stats=False,
                 line = '%s: %s' % (item.name, line)
             print(line)
 
+    if scaling:
+        for item in data.iter_suites():
+            lines = format_scaling(item.suite.get_benchmarks())
+            if lines:
+                print()
+                for line in lines:
+                    print(line)
+
 
 def cmd_show(args):
     display_benchmarks(args,
@@ -504,7 +549,8 @@ def cmd_show(args):
                        stats=args.stats,
                        dump=args.dump,
                        checks=not args.quiet,
-                       result=True)
+                       result=True,
+                       scaling=True)
 
 
 def cmd_metadata(args):
@@ -532,6 +578,13 @@ def cmd_timeit(args, timeit_runner):
     timeit_cli.main(timeit_runner)
 
 
+def cmd_command(args, command_runner):
+    import perf._command as command
+    command_runner.args = args
+    command_runner._process_args()
+    command.main(command_runner)
+
+
 def cmd_stats(args):
     display_benchmarks(args, stats=True, checks=not args.quiet)
 
@@ -676,6 +729,16 @@ def cmd_convert(args):
                       file=sys.stderr)
                 sys.exit(1)
 
+    if args.remove_outlier_processes:
+        for benchmark in suite:
+            try:
+                benchmark._remove_outlier_processes()
+            except ValueError:
+                print("ERROR: Benchmark %r has no more run after removing "
+                      "outlier processes" % benchmark.get_name(),
+                      file=sys.stderr)
+                sys.exit(1)
+
     compact = not(args.indent)
     if args.output_filename:
         suite.dump(args.output_filename, compact=compact)
@@ -704,13 +767,18 @@ def cmd_slowest(args):
                   % (index, bench.get_name(), format_timedelta(duration)))
 
 
+def cmd_rerun(args):
+    from perf._rerun import cmd_rerun
+    cmd_rerun(args)
+
+
 def cmd_system(args):
     from perf._system import System
     System().main(args.system_action, args)
 
 
 def main():
-    parser, timeit_runner = create_parser()
+    parser, timeit_runner, command_runner = create_parser()
     args = parser.parse_args()
     action = args.action
     try:
@@ -724,10 +792,12 @@ def main():
             'check': functools.partial(cmd_check, args),
             'collect_metadata': functools.partial(cmd_collect_metadata, args),
             'timeit': functools.partial(cmd_timeit, args, timeit_runner),
+            'command': functools.partial(cmd_command, args, command_runner),
             'convert': functools.partial(cmd_convert, args),
             'dump': functools.partial(cmd_dump, args),
             'slowest': functools.partial(cmd_slowest, args),
             'system': functools.partial(cmd_system, args),
+            'rerun': functools.partial(cmd_rerun, args),
         }
 
         try:
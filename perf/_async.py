@@ -0,0 +1,78 @@
+"""
+Benchmark asyncio coroutine functions: Runner.bench_async_func().
+"""
+from __future__ import division, print_function, absolute_import
+
+import sys
+
+import perf
+
+
+# The coroutine function is compiled at runtime, since the async/await syntax
+# is not supported by Python 2 and Python 3.4. The timer is read inside the
+# running event loop, so the creation of the event loop and the
+# run_until_complete() call are not measured.
+TEMPLATE = """
+async def bench_coro(loops, timer, coro_func, args):
+    range_it = range(loops)
+    if args:
+        t0 = timer()
+        for _ in range_it:
+            await coro_func(*args)
+        dt = timer() - t0
+    else:
+        # fast-path when coro_func has no argument: avoid the expensive
+        # coro_func(*args) argument unpacking
+        t0 = timer()
+        for _ in range_it:
+            await coro_func()
+        dt = timer() - t0
+    return dt
+"""
+
+
+def compile_bench_coro():
+    if sys.version_info < (3, 5):
+        raise RuntimeError("bench_async_func() requires Python 3.5 or newer")
+
+    namespace = {}
+    code = compile(TEMPLATE, "<perf-async>", "exec")
+    exec(code, namespace, namespace)
+    return namespace['bench_coro']
+
+
+def get_loop_name(loop):
+    loop_type = type(loop)
+    return '%s.%s' % (loop_type.__module__, loop_type.__name__)
+
+
+def bench_async_func(runner, name, coro_func, func_args,
+                     inner_loops=None, func_metadata=None,
+                     loop_factory=None):
+    if not runner.args.worker:
+        # the master only spawns worker processes
+        return runner._main(name, None, inner_loops, func_metadata)
+
+    import asyncio
+
+    bench_coro = compile_bench_coro()
+    if loop_factory is None:
+        loop_factory = asyncio.new_event_loop
+
+    # Use a single event loop for the whole worker process
+    loop = loop_factory()
+    try:
+        metadata = {}
+        if func_metadata:
+            metadata.update(func_metadata)
+        metadata['async_loop'] = get_loop_name(loop)
+
+        timer = perf.perf_counter
+
+        def sample_func(loops):
+            coro = bench_coro(loops, timer, coro_func, func_args)
+            return loop.run_until_complete(coro)
+
+        return runner._main(name, sample_func, inner_loops, metadata)
+    finally:
+        loop.close()
@@ -32,15 +32,20 @@ _CHECKED_METADATA = (
     'aslr',
     'cpu_count',
     'cpu_model_name',
+    'gc_policy',
     'hostname',
     'inner_loops',
+    'mlock',
     'name',
+    'nice',
     'platform',
     'python_executable',
     'python_implementation',
     'python_unicode',
     'python_version',
-    'unit')
+    'sched_policy',
+    'unit',
+    'worker_mode')
 
 
 _UNSET = object()
@@ -510,6 +515,12 @@ class Benchmark(object):
                 new_runs.append(run)
         self._replace_runs(new_runs)
 
+    def _remove_outlier_processes(self):
+        # Remove runs flagged by the --detect-outliers option of Runner
+        new_runs = [run for run in self._runs
+                    if not run._has_metadata('outlier_score')]
+        self._replace_runs(new_runs)
+
     def add_runs(self, benchmark):
         if not isinstance(benchmark, Benchmark):
             raise TypeError("expected Benchmark, got %s"
@@ -701,7 +712,9 @@ class BenchmarkSuite(object):
             suffix = u'.gz'
 
         flags = os.O_WRONLY | os.O_CREAT
-        if not replace:
+        if replace:
+            flags |= os.O_TRUNC
+        else:
             flags |= os.O_EXCL
         fd = os.open(filename, flags)
 
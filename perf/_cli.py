@@ -1,5 +1,8 @@
 from __future__ import division, print_function, absolute_import
 
+import collections
+import re
+
 import statistics
 
 from perf._formatter import (format_seconds, format_number,
@@ -242,9 +245,34 @@ def _format_stats(bench, lines):
 
     # Maximum
     lines.append("Maximum: %s" % format_limit(median, max(samples)))
+
+    _format_cpu_stats(bench, median, lines)
     return lines
 
 
+def _format_cpu_stats(bench, median, lines):
+    # Median per CPU of runs pinned to a single CPU (cpu metadata), only
+    # displayed if runs ran on different CPUs
+    cpu_samples = {}
+    for run in bench.get_runs():
+        cpu = run.get_metadata().get('cpu')
+        if cpu is None or not run.samples:
+            continue
+        cpu_samples.setdefault(cpu, []).extend(run.samples)
+    if len(cpu_samples) < 2:
+        return
+
+    lines.append('')
+    lines.append("Median per CPU:")
+    for cpu in sorted(cpu_samples):
+        samples = cpu_samples[cpu]
+        cpu_median = statistics.median(samples)
+        lines.append("- CPU %s: %s (%+.1f%%, %s)"
+                     % (cpu, bench.format_sample(cpu_median),
+                        (cpu_median - median) * 100.0 / median,
+                        format_number(len(samples), 'sample')))
+
+
 def format_histogram(benchmarks, bins=20, extend=False, lines=None):
     import collections
     import shutil
@@ -312,30 +340,40 @@ def format_histogram(benchmarks, bins=20, extend=False, lines=None):
     return lines
 
 
+# A benchmark is unstable if stdev/median is larger than 10%
+MAX_DISPERSION = 0.10
+
+
+def get_dispersion(bench):
+    # Return stdev/median, or None if it cannot be computed
+    samples = bench.get_samples()
+    median = bench.median()
+    # Avoid division by zero
+    if not median or len(samples) < 2:
+        return None
+    return statistics.stdev(samples) / median
+
+
 def format_checks(bench, lines=None):
     if lines is None:
         lines = []
     warn = lines.append
-    samples = bench.get_samples()
 
     # Display a warning if the standard deviation is larger than 10%
-    median = bench.median()
-    # Avoid division by zero
-    if median and len(samples) > 1:
-        k = statistics.stdev(samples) / median
-        if k > 0.10:
-            empty_line(lines)
+    k = get_dispersion(bench)
+    if k is not None and k > MAX_DISPERSION:
+        empty_line(lines)
 
-            if k > 0.20:
-                warn("ERROR: the benchmark is very unstable, the standard "
-                     "deviation is very high (stdev/median: %.0f%%)!"
-                     % (k * 100))
-            else:
-                warn("WARNING: the benchmark seems unstable, the standard "
-                     "deviation is high (stdev/median: %.0f%%)"
-                     % (k * 100))
-            warn("Try to rerun the benchmark with more runs, samples "
-                 "and/or loops")
+        if k > 0.20:
+            warn("ERROR: the benchmark is very unstable, the standard "
+                 "deviation is very high (stdev/median: %.0f%%)!"
+                 % (k * 100))
+        else:
+            warn("WARNING: the benchmark seems unstable, the standard "
+                 "deviation is high (stdev/median: %.0f%%)"
+                 % (k * 100))
+        warn("Try to rerun the benchmark with more runs, samples "
+             "and/or loops")
 
     # Check that the shortest sample took at least 1 ms
     shortest = min(bench._get_raw_samples())
@@ -369,6 +407,55 @@ def format_checks(bench, lines=None):
     return lines
 
 
+# (metadata name, unit) of scaling benchmarks: Runner.bench_threaded_func()
+# and Runner.bench_scaling_func()
+SCALING_METADATA = (('threads', ('thread', 'threads')),
+                    ('parallel_processes', ('process', 'processes')))
+
+
+def format_scaling(benchmarks, lines=None):
+    # Scaling efficiency of benchmarks of Runner.bench_threaded_func() and
+    # Runner.bench_scaling_func(): compare the throughput to the throughput
+    # of the smallest number of threads or processes
+    if lines is None:
+        lines = []
+
+    groups = collections.OrderedDict()
+    for bench in benchmarks:
+        metadata = bench.get_metadata()
+        for key, unit in SCALING_METADATA:
+            if key in metadata:
+                break
+        else:
+            continue
+        number = metadata[key]
+        name = bench.get_name()
+        match = re.match(r'^(.*) \((?:threads|processes)=[0-9]+\)$', name)
+        if match:
+            name = match.group(1)
+        groups.setdefault((name, unit), []).append((number, bench))
+
+    for (name, unit), items in groups.items():
+        if len(items) < 2:
+            continue
+        items.sort(key=lambda item: item[0])
+        ref_number, ref_bench = items[0]
+        ref_median = ref_bench.median()
+
+        empty_line(lines)
+        lines.append("Scaling of %s:" % name)
+        for number, bench in items:
+            median = bench.median()
+            speedup = ref_median / median
+            efficiency = speedup * ref_number / number
+            lines.append("- %s: %s per call, %.2fx throughput, "
+                         "efficiency %.0f%%"
+                         % (format_number(number, *unit),
+                            bench.format_sample(median),
+                            speedup, efficiency * 100))
+    return lines
+
+
 def format_benchmark(bench, checks=True, metadata=False,
                      dump=False, stats=False, hist=False, show_name=False,
                      result=True, display_runs_args=None):
@@ -0,0 +1,154 @@
+"""
+Benchmark external commands: Runner.bench_command() and the "perf command"
+command.
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import os
+import subprocess
+import sys
+
+import six
+
+import perf
+from perf._runner import Runner
+
+
+DEFAULT_NAME = 'command'
+
+
+def run_command(command, stdout):
+    # Spawn the command and wait until it completes.
+    # Return (exitcode, rusage) where rusage is None if not available.
+    proc = subprocess.Popen(command, stdout=stdout)
+    if not hasattr(os, 'wait4'):
+        return (proc.wait(), None)
+
+    # os.wait4() gets the resource usage of the child process
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        exitcode = -os.WTERMSIG(status)
+    else:
+        exitcode = os.WEXITSTATUS(status)
+    # the process was already reaped: don't wait it again
+    proc.returncode = exitcode
+    return (exitcode, rusage)
+
+
+def get_max_rss(rusage):
+    max_rss = rusage.ru_maxrss
+    if sys.platform != 'darwin':
+        # ru_maxrss is in kilobytes on Linux and BSD, in bytes on macOS
+        max_rss *= 1024
+    return max_rss
+
+
+class CommandSampleFunc(object):
+    def __init__(self, command, metadata):
+        self.command = command
+        # metadata of the worker run, updated with the child resource usage
+        self.metadata = metadata
+        self.nrun = 0
+        self.user_time = 0.0
+        self.sys_time = 0.0
+        self.max_rss = 0
+
+    def _add_rusage(self, rusage, worker_max_rss):
+        self.nrun += 1
+        self.user_time += rusage.ru_utime
+        self.sys_time += rusage.ru_stime
+        # On Linux, the child process inherits the maximum RSS of the worker
+        # process at fork, and keeps it after exec: the value is only the
+        # peak of the command if it is larger than the RSS of the worker
+        max_rss = get_max_rss(rusage)
+        if max_rss > worker_max_rss:
+            self.max_rss = max(self.max_rss, max_rss)
+
+        self.metadata['command_user_time'] = self.user_time / self.nrun
+        self.metadata['command_sys_time'] = self.sys_time / self.nrun
+        if self.max_rss:
+            self.metadata['command_max_rss'] = self.max_rss
+
+    def __call__(self, loops):
+        # use fast local variables
+        local_timer = perf.perf_counter
+        local_run = run_command
+        command = self.command
+        rusages = []
+
+        with open(os.devnull, 'wb') as stdout:
+            range_it = range(loops)
+
+            t0 = local_timer()
+            for _ in range_it:
+                exitcode, rusage = local_run(command, stdout)
+                if exitcode:
+                    raise RuntimeError("%s failed with exit code %s"
+                                       % (command[0], exitcode))
+                rusages.append(rusage)
+            dt = local_timer() - t0
+
+        if rusages and rusages[0] is not None:
+            import resource
+
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            worker_max_rss = get_max_rss(usage)
+            for rusage in rusages:
+                self._add_rusage(rusage, worker_max_rss)
+        return dt
+
+
+def bench_command(runner, name, command, func_metadata=None):
+    if isinstance(command, six.string_types) or not command:
+        raise ValueError("command must be a non-empty sequence of strings")
+    command = list(command)
+
+    metadata = {}
+    if func_metadata:
+        metadata.update(func_metadata)
+    metadata['command'] = ' '.join(command)
+
+    sample_func = CommandSampleFunc(command, metadata)
+    return runner._main(name, sample_func, None, metadata)
+
+
+def add_cmdline_args(cmd, args):
+    cmd.extend(('--name', args.name))
+    cmd.append('--')
+    cmd.extend(args.program)
+
+
+class CommandRunner(Runner):
+    def __init__(self, *args, **kw):
+        if 'program_args' not in kw:
+            kw['program_args'] = ('-m', 'perf', 'command')
+        kw['add_cmdline_args'] = add_cmdline_args
+        Runner.__init__(self, *args, **kw)
+
+        def parse_name(name):
+            return name.strip()
+
+        cmd = self.argparser
+        cmd.add_argument('--name', type=parse_name,
+                         help='Benchmark name (default: %r)' % DEFAULT_NAME)
+        cmd.add_argument('program', nargs=argparse.REMAINDER,
+                         help='Program and its arguments')
+
+    def _process_args(self):
+        Runner._process_args(self)
+        args = self.args
+
+        if args.program and args.program[0] == '--':
+            del args.program[0]
+        if not args.program:
+            print("ERROR: missing program to benchmark")
+            sys.exit(1)
+
+        if not args.name:
+            args.name = DEFAULT_NAME
+
+
+def main(runner):
+    args = runner.args
+    runner.bench_command(args.name, args.program)
@@ -138,3 +138,112 @@ def set_cpu_affinity(cpus):
 
     proc.cpu_affinity(cpus)
     return True
+
+
+# --sched option: policy name => name of the os constant
+SCHED_POLICIES = collections.OrderedDict((
+    ('normal', 'SCHED_OTHER'),
+    ('fifo', 'SCHED_FIFO'),
+    ('rr', 'SCHED_RR'),
+    ('idle', 'SCHED_IDLE'),
+))
+
+
+def set_scheduler(policy):
+    # Set the scheduling policy of the current process: return None on
+    # success, or an error message
+    if not hasattr(os, 'sched_setscheduler'):
+        return "os.sched_setscheduler() is not available"
+    sched = getattr(os, SCHED_POLICIES[policy], None)
+    if sched is None:
+        return "os.%s is not available" % SCHED_POLICIES[policy]
+
+    if policy in ('fifo', 'rr'):
+        # the lowest real-time priority is enough to not be preempted
+        # by tasks of the normal policy
+        priority = os.sched_get_priority_min(sched)
+    else:
+        priority = 0
+    try:
+        os.sched_setscheduler(0, sched, os.sched_param(priority))
+    except OSError as exc:
+        return str(exc)
+    return None
+
+
+def get_scheduler():
+    # Get the name of the scheduling policy of the current process,
+    # or None if it is unknown
+    if not hasattr(os, 'sched_getscheduler'):
+        return None
+    sched = os.sched_getscheduler(0)
+    # ignore the SCHED_RESET_ON_FORK flag
+    sched &= ~getattr(os, 'SCHED_RESET_ON_FORK', 0)
+    for policy, name in SCHED_POLICIES.items():
+        if getattr(os, name, None) == sched:
+            return policy
+    return str(sched)
+
+
+def set_nice(nice):
+    # Set the nice level of the current process: return None on success,
+    # or an error message
+    if not hasattr(os, 'setpriority'):
+        return "os.setpriority() is not available"
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, nice)
+    except OSError as exc:
+        return str(exc)
+    return None
+
+
+def get_nice():
+    if not hasattr(os, 'getpriority'):
+        return None
+    return os.getpriority(os.PRIO_PROCESS, 0)
+
+
+def get_cpu_siblings(cpu):
+    """Get the list of CPUs sharing the same physical core than cpu.
+
+    Return a sorted list of CPU identifiers (including cpu), or return None
+    if the topology is unknown.
+    """
+    path = sysfs_path('devices/system/cpu/cpu%s/topology/thread_siblings_list'
+                      % cpu)
+    siblings = read_first_line(path)
+    if not siblings:
+        return None
+    return parse_cpu_list(siblings)
+
+
+def select_sibling_free_cpus(cpus, ncpu, allow_siblings=False):
+    """Select ncpu CPUs of cpus which don't share a physical core.
+
+    If allow_siblings is true, fallback on CPUs which share a physical core
+    if there are not enough physical cores. Return a sorted list of CPU
+    identifiers, or return None if there are not enough CPUs.
+    """
+    cpus = sorted(set(cpus))
+    if len(cpus) < ncpu:
+        return None
+
+    selected = []
+    used = set()
+    for cpu in cpus:
+        if cpu in used:
+            continue
+        siblings = get_cpu_siblings(cpu)
+        if siblings:
+            used.update(siblings)
+        used.add(cpu)
+        selected.append(cpu)
+
+    if len(selected) < ncpu:
+        if not allow_siblings:
+            return None
+        # not enough physical cores: use hyperthreads
+        for cpu in cpus:
+            if cpu not in selected:
+                selected.append(cpu)
+    return sorted(selected[:ncpu])
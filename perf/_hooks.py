@@ -0,0 +1,82 @@
+"""
+Hooks instrumenting worker processes: the --hook option of Runner.
+"""
+from __future__ import division, print_function, absolute_import
+
+import importlib
+import numbers
+
+
+# Prefix of the run metadata keys of the values returned by after_sample(),
+# to not override metadata of perf like loops or duration
+METADATA_PREFIX = 'hook_'
+
+
+def load_hook(name):
+    # Import the hook class of a "module:class" name
+    module_name, sep, attr = name.partition(':')
+    if not sep or not module_name or not attr:
+        raise ValueError("hook name must be formatted as MODULE:CLASS")
+
+    hook_class = importlib.import_module(module_name)
+    for part in attr.split('.'):
+        hook_class = getattr(hook_class, part)
+    return hook_class
+
+
+def _check_hook_metadata(hook, metadata):
+    if not isinstance(metadata, dict):
+        raise TypeError("%s.after_sample() must return a dict or None, "
+                        "got %s" % (type(hook).__name__,
+                                    type(metadata).__name__))
+    for name, value in metadata.items():
+        if (not isinstance(value, numbers.Real)
+           or isinstance(value, bool)):
+            raise TypeError("%s.after_sample(): metadata %r value must be "
+                            "a number, got %s"
+                            % (type(hook).__name__, name,
+                               type(value).__name__))
+
+
+class HookManager(object):
+    # Call the methods of hooks in the worker process. All methods are
+    # optional: only hooks implementing a method are called.
+
+    def __init__(self, hook_classes):
+        hooks = [hook_class() for hook_class in hook_classes]
+        self.hooks = hooks
+        self._before_run = self._get_methods('before_run')
+        self._after_run = self._get_methods('after_run')
+        self._before_sample = self._get_methods('before_sample')
+        self._after_sample = [(hook, hook.after_sample) for hook in hooks
+                              if hasattr(hook, 'after_sample')]
+
+    def _get_methods(self, name):
+        return [getattr(hook, name) for hook in self.hooks
+                if hasattr(hook, name)]
+
+    def before_run(self, metadata):
+        for method in self._before_run:
+            method(metadata)
+
+    def after_run(self, metadata):
+        for method in reversed(self._after_run):
+            method(metadata)
+
+    def before_sample(self):
+        for method in self._before_sample:
+            method()
+
+    def after_sample(self):
+        # Return a dict of numeric values returned by hooks, or None
+        result = None
+        # call hooks in reverse order to nest them around the sample
+        for hook, method in reversed(self._after_sample):
+            metadata = method()
+            if metadata is None:
+                continue
+            _check_hook_metadata(hook, metadata)
+            if result is None:
+                result = {}
+            result.update(metadata)
+        return result
@@ -1,8 +1,11 @@
 from __future__ import division, print_function, absolute_import
 
+import os
+import sys
 import threading
 import time
 
+from perf._formatter import format_filesize
 from perf._utils import proc_path
 
 
@@ -51,6 +54,36 @@ class PeakMemoryUsageThread(threading.Thread):
         return self.peak_usage
 
 
+# mlockall() flags of Linux
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+def lock_memory():
+    # Lock current and future pages of the process in RAM using mlockall(),
+    # to not get page faults. Return None on success, or an error message.
+    if not sys.platform.startswith('linux'):
+        return "mlockall() is only supported on Linux"
+
+    # Once the RLIMIT_MEMLOCK limit is reached, locking future pages makes
+    # memory allocations fail: only lock the memory if the limit doesn't
+    # apply (unlimited, or root which has the CAP_IPC_LOCK capability)
+    import resource
+    limit = resource.getrlimit(resource.RLIMIT_MEMLOCK)[0]
+    if limit != resource.RLIM_INFINITY and os.geteuid() != 0:
+        return ("RLIMIT_MEMLOCK is limited to %s, memory allocations "
+                "would fail once the limit is reached"
+                % format_filesize(limit))
+
+    import ctypes
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        errno = ctypes.get_errno()
+        return "mlockall() failed: %s" % os.strerror(errno)
+    return None
+
+
 def check_tracking_memory():
     mem_thread = PeakMemoryUsageThread()
     try:
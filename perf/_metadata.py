@@ -57,6 +57,10 @@ def parse_load_avg(value):
         return float(value)
 
 
+def format_percent(value):
+    return '%.1f%%' % (value * 100)
+
+
 def format_noop(value):
     return value
 
@@ -71,14 +75,34 @@ DATETIME = _MetadataInfo(format_noop, six.string_types, None, None)
 METADATA = {
     'loops': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
     'inner_loops': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'failed_attempts': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'failed_processes': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'calibration_steps': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'calibration_time': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
+    'threads': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'parallel_processes': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
 
     'duration': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
     'uptime': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
     'load_avg_1min': _MetadataInfo(format_system_load, six.string_types + NUMBER_TYPES, is_positive, None),
 
+    'cpu': _MetadataInfo(format_generic, six.integer_types, is_positive, None),
+
     'mem_max_rss': BYTES,
+    'command_max_rss': BYTES,
+    'command_user_time': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
+    'command_sys_time': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
     'mem_peak_pagefile_usage': BYTES,
 
+    'median_ci': _MetadataInfo(format_percent, NUMBER_TYPES, is_positive, None),
+    'gc_collections_gen0': _MetadataInfo(format_number, six.integer_types, is_positive, 'integer'),
+    'gc_collections_gen1': _MetadataInfo(format_number, six.integer_types, is_positive, 'integer'),
+    'gc_collections_gen2': _MetadataInfo(format_number, six.integer_types, is_positive, 'integer'),
+    'nice': _MetadataInfo(format_generic, six.integer_types, None, None),
+    'env_padding': _MetadataInfo(format_filesize, six.integer_types, is_positive, 'byte'),
+    'outlier_score': _MetadataInfo(format_generic, NUMBER_TYPES, None, None),
+    'outlier_processes': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+
     'unit': _MetadataInfo(format_noop, six.string_types, UNIT_FORMATTERS.__contains__, None),
     'date': DATETIME,
     'boot_time': DATETIME,
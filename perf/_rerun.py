@@ -0,0 +1,202 @@
+"""
+Rerun unstable benchmarks of a benchmark suite: the "perf rerun" command.
+"""
+from __future__ import division, print_function, absolute_import
+
+import os.path
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import perf
+from perf._cli import MAX_DISPERSION, get_dispersion
+from perf._formatter import format_timedelta, format_number
+
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    # "90", "90s", "10m" or "1h": return a number of seconds
+    factor = 1
+    if value and value[-1] in DURATION_UNITS:
+        factor = DURATION_UNITS[value[-1]]
+        value = value[:-1]
+    value = float(value) * factor
+    if value <= 0:
+        raise ValueError("duration must be > 0")
+    return value
+
+
+def format_dispersion(bench):
+    dispersion = get_dispersion(bench)
+    if dispersion is None:
+        return 'n/a'
+    return '%.0f%%' % (dispersion * 100)
+
+
+def get_unstable_benchmarks(suite):
+    # Return benchmarks which don't pass the stdev/median check,
+    # the noisiest first
+    unstable = []
+    for bench in suite:
+        dispersion = get_dispersion(bench)
+        if dispersion is not None and dispersion > MAX_DISPERSION:
+            unstable.append((dispersion, bench))
+    unstable.sort(key=lambda item: item[0], reverse=True)
+    return [bench for dispersion, bench in unstable]
+
+
+def get_run_duration(bench):
+    # Average duration of a worker run, ignoring calibration runs
+    durations = [run._get_duration() for run in bench.get_runs()
+                 if not run._is_calibration()]
+    if not durations:
+        return None
+    return sum(durations) / len(durations)
+
+
+class Rerun(object):
+    def __init__(self, args):
+        self.args = args
+        self.suite = perf.BenchmarkSuite.load(args.filename)
+        self.output = args.output or args.filename
+        # Estimated cost in seconds of a worker process of each benchmark,
+        # including the Python startup
+        self.worker_costs = {}
+        self.tmpdir = None
+        # Names of benchmarks which cannot be rerun
+        self.skipped = set()
+        # Names of benchmarks which failed to be rerun
+        self.failed = []
+
+    def _skip_bench(self, bench):
+        # Return True if the benchmark cannot be rerun
+        name = bench.get_name()
+        if name in self.skipped:
+            return True
+        if 'cold_start' in bench.get_metadata():
+            # a --cold-start benchmark is computed by the --cold-start mode
+            # of the steady-state benchmark, it cannot be selected alone
+            print("%s: skip cold start benchmark" % name)
+            self.skipped.add(name)
+            return True
+        return False
+
+    def _run_script(self, bench, nprocess):
+        # Run nprocess workers of the benchmark with the loops, samples and
+        # warmups of the existing runs, return the new benchmark
+        args = self.args
+        output = os.path.join(self.tmpdir, 'rerun.json')
+        if os.path.exists(output):
+            os.unlink(output)
+
+        nsample = int(round(bench._get_nsample_per_run()))
+        nwarmup = int(round(bench._get_nwarmup()))
+        loops = int(round(bench._get_loops()))
+
+        cmd = [args.python]
+        cmd.extend(args.script)
+        cmd.extend(('--benchmark', '^%s$' % re.escape(bench.get_name()),
+                    '--processes', str(nprocess),
+                    '--samples', str(nsample),
+                    '--warmups', str(nwarmup),
+                    '--loops', str(loops),
+                    '--quiet', '--output', output))
+        with open(os.devnull, 'wb') as stdout:
+            exitcode = subprocess.call(cmd, stdout=stdout)
+        if exitcode:
+            raise RuntimeError("%s failed with exit code %s"
+                               % (cmd[1], exitcode))
+        if not os.path.exists(output):
+            raise RuntimeError("%s didn't run the benchmark %s"
+                               % (cmd[1], bench.get_name()))
+        return perf.Benchmark.load(output)
+
+    def _rerun_bench(self, bench, remaining):
+        # Return False if a worker doesn't fit in the remaining time.
+        # Return True if the benchmark was rerun, or if the rerun failed.
+        name = bench.get_name()
+        cost = self.worker_costs.get(name)
+        if cost is None:
+            cost = get_run_duration(bench)
+            if cost is None:
+                return False
+        nprocess = self.args.processes
+        if cost > 0:
+            nprocess = min(nprocess, int(remaining // cost))
+        if nprocess < 1:
+            return False
+
+        old_dispersion = format_dispersion(bench)
+        start = perf.monotonic_clock()
+        try:
+            new_bench = self._run_script(bench, nprocess)
+        except RuntimeError as exc:
+            # don't rerun the benchmark again, but rerun other benchmarks
+            print("ERROR: failed to rerun %s: %s" % (name, exc))
+            sys.stdout.flush()
+            self.skipped.add(name)
+            self.failed.append(name)
+            return True
+        dt = perf.monotonic_clock() - start
+        self.worker_costs[name] = dt / nprocess
+
+        self.suite.add_runs(new_bench)
+        # write the result after each step to not lose runs on error
+        self.suite.dump(self.output, replace=True)
+
+        bench = self.suite.get_benchmark(name)
+        print("%s: add %s (stdev/median: %s -> %s)"
+              % (name, format_number(nprocess, 'run'), old_dispersion,
+                 format_dispersion(bench)))
+        sys.stdout.flush()
+        return True
+
+    def _main(self):
+        budget = self.args.budget
+        deadline = perf.monotonic_clock() + budget
+
+        while True:
+            unstable = [bench for bench in get_unstable_benchmarks(self.suite)
+                        if not self._skip_bench(bench)]
+            if not unstable:
+                if self.skipped:
+                    print("Other benchmarks are stable")
+                else:
+                    print("All benchmarks are stable")
+                break
+
+            remaining = deadline - perf.monotonic_clock()
+            # Rerun the noisiest benchmark which fits in the remaining
+            # budget, and then rank again the benchmarks
+            for bench in unstable:
+                if self._rerun_bench(bench, remaining):
+                    break
+            else:
+                names = ', '.join(bench.get_name() for bench in unstable)
+                print("Budget of %s exhausted, unstable benchmarks: %s"
+                      % (format_timedelta(budget), names))
+                break
+
+    def main(self):
+        self.tmpdir = tempfile.mkdtemp()
+        try:
+            self._main()
+        finally:
+            shutil.rmtree(self.tmpdir)
+
+        if self.failed:
+            print("ERROR: failed to rerun %s: %s"
+                  % (format_number(len(self.failed), 'benchmark'),
+                     ', '.join(self.failed)))
+            sys.exit(1)
+
+
+def cmd_rerun(args):
+    if not args.script:
+        print("ERROR: missing benchmark script")
+        sys.exit(1)
+    Rerun(args).main()
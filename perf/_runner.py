@@ -1,22 +1,43 @@
 from __future__ import division, print_function, absolute_import
 
 import argparse
+import atexit
+import collections
+import copy
 import errno
+import gc
+import itertools
+import json
 import math
 import os
+import platform
+import random
+import re
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import traceback
 
 import six
+import statistics
 
 import perf
 from perf._cli import format_run, format_benchmark, multiline_output
 from perf._bench import _load_suite_from_pipe
 from perf._cpu_utils import (format_cpu_list, parse_cpu_list,
-                             get_isolated_cpus, set_cpu_affinity)
-from perf._formatter import format_timedelta, format_number, format_sample
+                             get_isolated_cpus, set_cpu_affinity,
+                             get_logical_cpu_count, select_sibling_free_cpus,
+                             SCHED_POLICIES, set_scheduler, get_scheduler,
+                             set_nice, get_nice)
+from perf._formatter import (format_timedelta, format_number, format_sample,
+                             format_seconds)
+from perf._hooks import load_hook, HookManager, METADATA_PREFIX
 from perf._utils import (MS_WINDOWS, popen_killer,
-                         abs_executable, create_environ, pipe_cloexec)
+                         abs_executable, create_environ, pipe_cloexec,
+                         ENV_PADDING_VAR, replace_file,
+                         median_confidence_interval, robust_zscore)
 
 try:
     # Optional dependency
@@ -25,6 +46,260 @@ except ImportError:
     psutil = None
 
 
+# Minimum number of processes of the --target-ci mode: run at least 3
+# processes to benchmark 3 different (randomized) hash functions
+MIN_ADAPTIVE_PROCESSES = 3
+
+# --calibration-cache: cached loops are reused if the median raw sample of
+# the first worker is in [min_time * (1 - tolerance),
+# 2 * min_time * (1 + tolerance)], the range of a calibrated raw sample
+CALIBRATION_CACHE_TOLERANCE = 0.5
+
+# Calibration: maximum factor used to extrapolate the number of loops from
+# a raw sample. Raw samples much shorter than min_time are not reliable
+# enough to predict the number of loops in a single step.
+CALIBRATION_MAX_FACTOR = 2 ** 10
+
+# --detect-outliers: the run of a worker process is an outlier if the modified
+# z-score of its median sample is larger than OUTLIER_THRESHOLD, compared to
+# the median samples of at least MIN_OUTLIER_RUNS other runs. The first
+# MIN_OUTLIER_RUNS runs are checked once enough runs are available. The MAD is
+# at least OUTLIER_MIN_MAD of the median, to not flag tiny differences
+# when all runs are very close.
+OUTLIER_THRESHOLD = 3.5
+MIN_OUTLIER_RUNS = 3
+OUTLIER_MIN_MAD = 0.01
+
+# --gc policies of the garbage collector
+GC_POLICIES = ('default', 'disable', 'collect-before-sample', 'freeze')
+
+# Runner.bench_func(inputs=...): default maximum number of argument tuples
+# of the pool, the pool is cycled if the number of loops is larger
+INPUT_POOL_SIZE = 1024
+
+# Name of the benchmarks of Runner.bench_threaded_func()
+THREADS_NAME = '%s (threads=%s)'
+
+# Name of the benchmarks of Runner.bench_scaling_func()
+PROCESSES_NAME = '%s (processes=%s)'
+
+# Name of the first call benchmarks of the --cold-start mode
+COLD_START_NAME = '%s (cold start)'
+
+# --cold-start: maximum number of fresh worker processes per benchmark
+MAX_COLD_START_PROCESSES = 100
+
+
+def _bench_threads(nthread, func, args, loops):
+    # Call func(*args) loops times in nthread threads which start at the same
+    # time: return the elapsed time until all threads complete
+    ready = threading.Semaphore(0)
+    start = threading.Event()
+    errors = []
+
+    def run_thread():
+        # use fast local variables
+        local_func = func
+        local_args = args
+        range_it = range(loops)
+
+        ready.release()
+        start.wait()
+        try:
+            for _ in range_it:
+                local_func(*local_args)
+        except BaseException:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=run_thread)
+               for _ in range(nthread)]
+    for thread in threads:
+        thread.start()
+    # start barrier: wait until all threads are ready to run
+    for _ in threads:
+        ready.acquire()
+
+    t0 = perf.perf_counter()
+    start.set()
+    for thread in threads:
+        thread.join()
+    dt = perf.perf_counter() - t0
+
+    if errors:
+        six.reraise(*errors[0])
+    return dt
+
+
+def _get_input_pool(inputs, size):
+    # Runner.bench_func(inputs=...): return a list of size argument tuples,
+    # cycle on the inputs if the iterable produces less than size tuples
+    pool = [tuple(item) for item in itertools.islice(inputs(), size)]
+    if not pool:
+        raise ValueError("inputs produced no argument tuple")
+    if len(pool) < size:
+        pool = list(itertools.islice(itertools.cycle(pool), size))
+    return pool
+
+
+def _update_suite_metadata(suite, metadata):
+    for bench in suite:
+        runs = [run._update_metadata(metadata) for run in bench.get_runs()]
+        bench._replace_runs(runs)
+
+
+class _StreamRun(object):
+    # --stream mode: build a run from the events of a worker, to keep the
+    # samples of a worker which crashed, stalled or timed out
+
+    def __init__(self):
+        self._reset(None)
+
+    def _reset(self, metadata):
+        self.metadata = metadata
+        self.warmups = []
+        self.samples = []
+        self.loops = None
+
+    def add_event(self, data):
+        # Return the sample value of a sample event, or None
+        event = data['event']
+        if event == 'start':
+            self._reset(data['metadata'])
+        elif event in ('calibration', 'warmup'):
+            self.warmups.append((data['loops'], data['raw_sample']))
+        elif event == 'sample':
+            inner_loops = 1
+            if self.metadata is not None:
+                inner_loops = self.metadata.get('inner_loops', 1)
+            self.loops = data['loops']
+            value = data['raw_sample'] / (self.loops * inner_loops)
+            self.samples.append(value)
+            return value
+        return None
+
+    def get_unit(self):
+        if self.metadata is None:
+            return 'second'
+        return self.metadata.get('unit', 'second')
+
+    def get_run(self, metadata=None):
+        # Return None if the worker didn't send its metadata or no valid
+        # sample
+        if (self.metadata is None or not self.samples
+           or not all(value > 0 for value in self.samples)):
+            return None
+        run_metadata = dict(self.metadata, loops=self.loops)
+        if metadata:
+            run_metadata.update(metadata)
+        return perf.Run(self.samples, warmups=self.warmups,
+                        metadata=run_metadata, collect_metadata=False)
+
+
+class _WorkerError(RuntimeError):
+    # A worker failed: partial_run is the run built from its --stream
+    # events, or None
+
+    def __init__(self, msg, partial_run=None):
+        RuntimeError.__init__(self, msg)
+        self.partial_run = partial_run
+
+
+class _PipeReader(object):
+    # Read lines of a worker pipe in a thread, to be able to read with a
+    # timeout on all platforms
+
+    def __init__(self, rfile):
+        self._lines = six.moves.queue.Queue()
+        thread = threading.Thread(target=self._read_lines, args=(rfile,))
+        thread.daemon = True
+        thread.start()
+
+    def _read_lines(self, rfile):
+        try:
+            for line in iter(rfile.readline, ''):
+                self._lines.put(line)
+        except (IOError, ValueError):
+            # the pipe was closed
+            pass
+        # end of file
+        self._lines.put('')
+
+    def readline(self, timeout=None):
+        # Return None on timeout, or an empty string at the end of file
+        try:
+            return self._lines.get(timeout=timeout)
+        except six.moves.queue.Empty:
+            return None
+
+
+class _ForkedProcess(object):
+    # Worker process of the --fork mode: implement the subset of the
+    # subprocess.Popen API used by the master
+    stdin = None
+    stdout = None
+    stderr = None
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+    def wait(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, 0)
+            if os.WIFSIGNALED(status):
+                self.returncode = -os.WTERMSIG(status)
+            else:
+                self.returncode = os.WEXITSTATUS(status)
+        return self.returncode
+
+
+class _PoolWorker(object):
+    # Long-lived worker process of the --pool mode: it runs benchmark tasks
+    # one after another, the master sends tasks as JSON lines into the
+    # command pipe.
+
+    def __init__(self, proc, cmd, command_file, result_file):
+        self.proc = proc
+        self.cmd = cmd
+        self._command_file = command_file
+        self._result_file = result_file
+        # _PipeReader of the --stream mode
+        self.reader = None
+        # number of tasks run by the worker
+        self.ntask = 0
+
+    def run_task(self, command, read_stream):
+        with popen_killer(self.proc):
+            self._command_file.write(json.dumps(command) + "\n")
+            self._command_file.flush()
+            if self.reader is not None:
+                bench_json = read_stream(self.reader)
+            else:
+                bench_json = self._result_file.readline()
+
+        if not bench_json:
+            exitcode = self.stop()
+            raise RuntimeError("%s failed with exit code %s"
+                               % (self.cmd[0], exitcode))
+
+        self.ntask += 1
+        return bench_json
+
+    def stop(self):
+        # Closing the command pipe asks the worker to exit
+        try:
+            self._command_file.close()
+        except IOError:
+            # broken pipe: the worker already exited
+            pass
+        exitcode = self.proc.wait()
+        self._result_file.close()
+        return exitcode
+
+
 class Runner:
     # Default parameters are chosen to have approximatively a run of 0.5 second
     # and so a total duration of 5 seconds by default
@@ -64,6 +339,73 @@ class Runner:
         # see the --worker-task command line option
         self._worker_task = 0
 
+        # CPUs used by parallel workers, see the --jobs command line option
+        self._job_cpus = None
+
+        # CPUs assigned to worker processes in round-robin order, see the
+        # --rotate-cpus command line option. The rotation starts at the first
+        # worker computing samples: _rotate_offset is the number of
+        # calibration workers of the current benchmark.
+        self._rotate_cpus = None
+        self._rotate_offset = 0
+
+        # Hook classes of the --hook command line option. Worker: HookManager
+        # created by the first benchmark run, None if no hook is used.
+        self._hook_classes = []
+        self._hooks = None
+
+        # Master of Runner.bench_scaling_func(): number of synchronized worker
+        # processes of the current benchmark
+        self._scaling_processes = None
+
+        # --pool mode. Master: dictionary of _PoolWorker objects. Worker:
+        # pipe used to read commands of the master and the current command.
+        self._pool = None
+        self._pool_command_file = None
+        self._pool_command = None
+
+        # Worker of the --pool and --stream modes: file of the --pipe option,
+        # kept open to write multiple JSON lines
+        self._pipe_file = None
+
+        # Master: failed worker attempts and abandoned worker processes of
+        # the current benchmark (--max-retries option). Lists are used since
+        # workers can be spawned by threads (--jobs option).
+        self._failed_attempts = []
+        self._failed_processes = []
+        self._worker_success = False
+
+        # Master of the --time-budget mode: start of the budget and number of
+        # benchmark tasks of the script (None if unknown)
+        self._budget_start = None
+        self._task_count = None
+        self._tasks_counted = False
+
+        # Master of the --eta mode: wall-clock durations of the completed
+        # benchmarks
+        self._bench_durations = []
+
+        # Master of the --plan mode: benchmarks of the previous result and
+        # list of (name, estimated duration) where the duration is None if
+        # the benchmark is not in the previous result
+        self._plan_suite = None
+        self._plan_durations = []
+        # Number of benchmark tasks skipped by --benchmark and --exclude
+        self._skipped_tasks = 0
+
+        # Master of the --fork mode: (name, sample_func, inner_loops, metadata)
+        # of the current benchmark, run by forked worker processes
+        self._fork_task = None
+
+        # Worker of the --mlock mode: True if mlockall() succeeded
+        self._memory_locked = False
+
+        # --interleave mode: list of (name, sample_func, inner_loops,
+        # metadata) tuples of the benchmarks of the script
+        self._interleave_tasks = []
+        # Master of the --interleave mode: number of loops of each benchmark
+        self._task_loops = None
+
         # result of argparser.parse_args()
         self.args = None
 
@@ -82,6 +424,7 @@ class Runner:
         else:
             self._program_args = (sys.argv[0],)
         self._show_name = show_name
+        self._max_time = max_time
 
         def strictly_positive(value):
             value = int(value)
@@ -101,6 +444,21 @@ class Runner:
                 raise ValueError("value must be >= 0")
             return value
 
+        def percentage(value):
+            if value.endswith('%'):
+                value = float(value[:-1]) / 100.0
+            else:
+                value = float(value)
+            if value <= 0:
+                raise ValueError("value must be > 0")
+            return value
+
+        def regex(value):
+            try:
+                return re.compile(value)
+            except re.error as exc:
+                raise ValueError("invalid regular expression: %s" % exc)
+
         def comma_separated(values):
             values = [value.strip() for value in values.split(',')]
             return list(filter(None, values))
@@ -121,6 +479,15 @@ class Runner:
                             type=strictly_positive, default=processes,
                             help='number of processes used to run benchmarks '
                                  '(default: %s)' % processes)
+        parser.add_argument('--target-ci', metavar='WIDTH', type=percentage,
+                            help='Spawn worker processes until the relative '
+                                 'width of the 95%% confidence interval of '
+                                 'the median is smaller than WIDTH '
+                                 '(ex: 1%%)')
+        parser.add_argument('--max-processes', metavar='PROCESSES',
+                            type=strictly_positive,
+                            help='Maximum number of processes of the '
+                                 '--target-ci mode (default: 2 x PROCESSES)')
         parser.add_argument('-n', '--samples', dest="samples",
                             type=strictly_positive, default=samples,
                             help='number of samples per process (default: %s)'
@@ -135,6 +502,13 @@ class Runner:
                             help='number of loops per sample, 0 means '
                                  'automatic calibration (default: %s)'
                             % loops)
+        parser.add_argument('-b', '--benchmark', metavar='REGEX',
+                            type=regex,
+                            help='Only run benchmarks with a name matching '
+                                 'the regular expression REGEX')
+        parser.add_argument('--exclude', metavar='REGEX', type=regex,
+                            help="Don't run benchmarks with a name matching "
+                                 "the regular expression REGEX")
         parser.add_argument('-v', '--verbose', action="store_true",
                             help='enable verbose mode')
         parser.add_argument('-q', '--quiet', action="store_true",
@@ -142,6 +516,50 @@ class Runner:
         parser.add_argument('--pipe', type=int, metavar="FD",
                             help='Write benchmarks encoded as JSON '
                                  'into the pipe FD')
+        parser.add_argument('--stream', action="store_true",
+                            help='Workers write calibration, warmup and '
+                                 'samples events into the pipe as soon as '
+                                 'they are computed')
+        parser.add_argument('--stall-timeout', metavar='SECONDS',
+                            type=float,
+                            help='Kill a worker which wrote no event since '
+                                 'SECONDS seconds (imply --stream)')
+        parser.add_argument('--worker-timeout', metavar='SECONDS',
+                            type=float,
+                            help='Kill a worker which did not complete '
+                                 'after SECONDS seconds')
+        parser.add_argument('--max-retries', type=positive_or_nul,
+                            default=0,
+                            help='Respawn a worker which failed (crash, '
+                                 'timeout) up to MAX_RETRIES times '
+                                 '(default: 0)')
+        parser.add_argument('--sched', choices=tuple(SCHED_POLICIES),
+                            help='Scheduling policy of worker processes')
+        parser.add_argument('--nice', type=int,
+                            help='Nice level of worker processes')
+        parser.add_argument('--mlock', action="store_true",
+                            help='Lock the memory of worker processes in RAM '
+                                 'using mlockall()')
+        parser.add_argument('--hook', metavar='MODULE:CLASS',
+                            action='append', default=[],
+                            help='Hook called by worker processes before and '
+                                 'after each run and each sample, can be used '
+                                 'multiple times')
+        parser.add_argument('--cold-start', action="store_true",
+                            help='Also measure the first call of each '
+                                 'benchmark in fresh worker processes run '
+                                 'in parallel: 1 loop, no warmup and 1 '
+                                 'sample per process')
+        parser.add_argument('--gc', choices=GC_POLICIES,
+                            help='Garbage collector policy of worker '
+                                 'processes during samples, record the '
+                                 'number of collections in metadata')
+        parser.add_argument('--detect-outliers', action="store_true",
+                            help='Flag the run of a worker process which is '
+                                 'an outlier compared to previous runs')
+        parser.add_argument('--replace-outliers', action="store_true",
+                            help='Spawn a new worker process for each '
+                                 'outlier run (imply --detect-outliers)')
         parser.add_argument('-o', '--output', metavar='FILENAME',
                             help='write results encoded to JSON into FILENAME')
         parser.add_argument('--append', metavar='FILENAME',
@@ -151,11 +569,43 @@ class Runner:
                                  'sample, used to calibrate the number of '
                                  'loops (default: %s)'
                             % format_timedelta(min_time))
+        parser.add_argument('--max-time', type=float, default=None,
+                            help='Maximum duration in seconds of a single '
+                                 'sample, used to calibrate the number of '
+                                 'loops (default: %s, or MIN_TIME if larger)'
+                            % format_timedelta(max_time))
+        parser.add_argument('--time-budget', metavar='SECONDS', type=float,
+                            help='Share a wall-clock time budget of SECONDS '
+                                 'seconds between the benchmarks: stop '
+                                 'spawning workers of a benchmark when its '
+                                 'share of the budget is exhausted')
+        parser.add_argument('--eta', action="store_true",
+                            help='Display the estimated remaining duration '
+                                 'of the benchmark and of the script')
+        parser.add_argument('--plan', metavar='FILENAME',
+                            help="Don't run benchmarks: estimate the duration "
+                                 "of the script from the total duration of "
+                                 "benchmarks of a previous JSON result")
+        parser.add_argument('--calibration-cache', metavar='FILENAME',
+                            help='Read and write the number of loops of '
+                                 'calibrated benchmarks into the JSON file '
+                                 'FILENAME to skip the calibration')
         parser.add_argument('--worker', action='store_true',
                             help='Worker process, run the benchmark.')
         parser.add_argument('--worker-task', type=positive_or_nul, metavar='TASK_ID',
                             help='Identifier of the worker task: '
                                  'only execute the benchmark function TASK_ID')
+        parser.add_argument('--pool-pipe', type=int, metavar='FD',
+                            help='Worker process of the --pool mode: '
+                                 'read worker tasks from the pipe FD')
+        parser.add_argument('--start-pipe', type=int, metavar='FD',
+                            help='Worker process of '
+                                 'Runner.bench_scaling_func(): wait until '
+                                 'the master writes into the pipe FD to '
+                                 'start the benchmark')
+        parser.add_argument('--count-tasks', action="store_true",
+                            help='Worker process of the --time-budget mode: '
+                                 'only count benchmark tasks')
         parser.add_argument('--calibrate', action="store_true",
                             help="only calibrate the benchmark, "
                                  "don't compute samples")
@@ -174,6 +624,39 @@ class Runner:
                                  'run variation. By default, worker processes '
                                  'are pinned to isolate CPUs if isolated CPUs '
                                  'are found.')
+        parser.add_argument('-j', '--jobs', type=strictly_positive,
+                            default=1,
+                            help='Number of worker processes running in '
+                                 'parallel, each worker is pinned to its '
+                                 'own CPU (default: 1)')
+        parser.add_argument('--rotate-cpus', action="store_true",
+                            help='Pin each worker process to a single CPU, '
+                                 'taken from the allowed CPUs in round-robin '
+                                 'order, and store the CPU in metadata')
+        parser.add_argument('--pool', action="store_true",
+                            help='Reuse worker processes to run the '
+                                 'following benchmarks, rather than spawning '
+                                 'new worker processes for each benchmark')
+        parser.add_argument('--fork', action="store_true",
+                            help='Fork the master process to create worker '
+                                 'processes, rather than spawning new '
+                                 'processes, to not pay the Python startup '
+                                 'and imports in each worker')
+        parser.add_argument('--interleave', action="store_true",
+                            help='Run all benchmarks of the script in each '
+                                 'worker process, in a random order, rather '
+                                 'than spawning worker processes for each '
+                                 'benchmark')
+        parser.add_argument('--task-loops', metavar='LOOPS_LIST',
+                            help='Worker process of the --interleave mode: '
+                                 'comma-separated list of the number of loops '
+                                 'of each benchmark')
+        parser.add_argument('--max-tasks-per-worker', metavar='TASKS',
+                            type=positive_or_nul, default=0,
+                            help='In --pool mode, replace a worker process '
+                                 'with a new process after it ran TASKS '
+                                 'benchmarks, 0 means unlimited '
+                                 '(default: 0)')
         parser.add_argument("--inherit-environ", metavar='VARS',
                             type=comma_separated,
                             help='Comma-separated list of environment '
@@ -183,6 +666,10 @@ class Runner:
                             dest="locale", action="store_false", default=True,
                             help="Don't copy locale environment variables "
                                  "like LANG or LC_CTYPE.")
+        parser.add_argument("--randomize-env", action="store_true",
+                            help='Set a random PYTHONHASHSEED and pad the '
+                                 'environment by a random size in each worker '
+                                 'process to randomize the memory layout')
         parser.add_argument("--python", default=sys.executable,
                             help='Python executable '
                                  '(default: use running Python, '
@@ -225,6 +712,45 @@ class Runner:
             args.loops = 1
             args.min_time = 1e-9
 
+        if args.stall_timeout is not None:
+            if args.stall_timeout <= 0:
+                print("ERROR: --stall-timeout must be greater than zero")
+                sys.exit(1)
+            args.stream = True
+
+        if args.worker_timeout is not None and args.worker_timeout <= 0:
+            print("ERROR: --worker-timeout must be greater than zero")
+            sys.exit(1)
+
+        if args.max_time is None:
+            # the default max_time must not reject a larger --min-time
+            args.max_time = max(self._max_time, args.min_time)
+        elif args.max_time < args.min_time:
+            print("ERROR: --max-time must be greater than or equal to "
+                  "--min-time")
+            sys.exit(1)
+
+        if args.time_budget is not None and args.time_budget <= 0:
+            print("ERROR: --time-budget must be greater than zero")
+            sys.exit(1)
+
+        if args.plan and not args.worker:
+            try:
+                self._plan_suite = perf.BenchmarkSuite.load(args.plan)
+            except Exception as exc:
+                print("ERROR: unable to load %s: %s" % (args.plan, exc))
+                sys.exit(1)
+
+        if args.count_tasks:
+            if not args.worker or args.pipe is None:
+                print("ERROR: --count-tasks can only be used with --worker "
+                      "and --pipe")
+                sys.exit(1)
+            atexit.register(self._write_task_count)
+
+        if args.target_ci and not args.max_processes:
+            args.max_processes = args.processes * 2
+
         if args.calibrate:
             if not args.worker:
                 print("ERROR: Calibration can only be done "
@@ -245,6 +771,63 @@ class Runner:
             print("ERROR: --worker-task can only be used with --worker")
             sys.exit(1)
 
+        if args.pool_pipe is not None and not args.worker:
+            print("ERROR: --pool-pipe can only be used with --worker")
+            sys.exit(1)
+
+        if args.start_pipe is not None and not args.worker:
+            print("ERROR: --start-pipe can only be used with --worker")
+            sys.exit(1)
+
+        if args.pool and args.jobs > 1:
+            print("ERROR: --pool is incompatible with --jobs")
+            sys.exit(1)
+
+        if args.fork:
+            if not hasattr(os, 'fork'):
+                print("ERROR: --fork requires os.fork()")
+                sys.exit(1)
+            if (args.pool or args.jobs > 1 or args.interleave
+               or args.randomize_env):
+                print("ERROR: --fork is incompatible with --pool, --jobs, "
+                      "--interleave and --randomize-env")
+                sys.exit(1)
+
+        if args.rotate_cpus:
+            if args.pool or args.jobs > 1 or args.fork or args.interleave:
+                print("ERROR: --rotate-cpus is incompatible with --pool, "
+                      "--jobs, --fork and --interleave")
+                sys.exit(1)
+
+        if args.interleave:
+            if (args.pool or args.target_ci or args.time_budget
+               or args.cold_start or args.detect_outliers
+               or args.replace_outliers or args.calibration_cache
+               or args.eta):
+                print("ERROR: --interleave is incompatible with --pool, "
+                      "--target-ci, --time-budget, --cold-start, "
+                      "--detect-outliers, --replace-outliers, "
+                      "--calibration-cache and --eta")
+                sys.exit(1)
+        if args.replace_outliers:
+            args.detect_outliers = True
+
+        if args.gc == 'freeze' and not hasattr(gc, 'freeze'):
+            print("ERROR: --gc=freeze requires gc.freeze() (Python 3.7+)")
+            sys.exit(1)
+
+        for name in args.hook:
+            try:
+                hook_class = load_hook(name)
+            except Exception as exc:
+                print("ERROR: unable to load the hook %s: %s" % (name, exc))
+                sys.exit(1)
+            self._hook_classes.append(hook_class)
+
+        if args.task_loops is not None and not args.worker:
+            print("ERROR: --task-loops can only be used with --worker")
+            sys.exit(1)
+
         if args.tracemalloc:
             try:
                 import tracemalloc   # noqa
@@ -263,8 +846,51 @@ class Runner:
                       "(--track-memory): %s" % err_msg)
                 sys.exit(1)
 
+        if args.jobs > 1 and not args.worker:
+            self._job_cpus = self._get_cpus(args.jobs)
+            if not self._job_cpus:
+                print("ERROR: unable to get %s CPUs which don't share a "
+                      "physical core to run %s jobs in parallel"
+                      % (args.jobs, args.jobs))
+                sys.exit(1)
+
+        if args.rotate_cpus and not args.worker:
+            self._rotate_cpus = self._get_allowed_cpus()
+            if not self._rotate_cpus:
+                print("ERROR: unable to get the list of CPUs (--rotate-cpus)")
+                sys.exit(1)
+
         args.python = abs_executable(args.python)
 
+    def _get_allowed_cpus(self):
+        # CPUs of --affinity, or isolated CPUs, or all CPUs
+        args = self.args
+        if args.affinity:
+            return parse_cpu_list(args.affinity)
+
+        cpus = get_isolated_cpus()
+        if not cpus:
+            cpu_count = get_logical_cpu_count()
+            if not cpu_count:
+                return None
+            cpus = list(range(cpu_count))
+        return cpus
+
+    def _get_cpus(self, ncpu, allow_siblings=False):
+        # Get ncpu CPUs which don't share a physical CPU core. If
+        # allow_siblings is true, use CPUs sharing a physical core if needed.
+        cpus = self._get_allowed_cpus()
+        if not cpus:
+            return None
+        return select_sibling_free_cpus(cpus, ncpu, allow_siblings)
+
+    def _get_rotated_cpu(self, process):
+        # --rotate-cpus: CPU of the worker of the process-th run, or None
+        cpus = self._rotate_cpus
+        if not cpus:
+            return None
+        return cpus[(process - 1 - self._rotate_offset) % len(cpus)]
+
     def parse_args(self, args=None):
         if self.args is None:
             self.args = self.argparser.parse_args(args)
@@ -312,6 +938,40 @@ class Runner:
                       "isolated CPUs, CPU affinity not available")
                 print("Use Python 3.3 or newer, or install psutil dependency")
 
+    def _set_scheduling(self, metadata):
+        # Worker: apply --sched, --nice and --mlock options, and store the
+        # effective policy in metadata
+        args = self.args
+        if not(args.sched or args.nice is not None or args.mlock):
+            return
+
+        if args.sched:
+            error = set_scheduler(args.sched)
+            if error and not args.quiet:
+                print("WARNING: unable to set the %s scheduling policy: %s"
+                      % (args.sched, error))
+        if args.nice is not None:
+            error = set_nice(args.nice)
+            if error and not args.quiet:
+                print("WARNING: unable to set the nice level to %s: %s"
+                      % (args.nice, error))
+        if args.mlock and not self._memory_locked:
+            from perf._memory import lock_memory
+            error = lock_memory()
+            if error:
+                if not args.quiet:
+                    print("WARNING: unable to lock the memory: %s" % error)
+            else:
+                self._memory_locked = True
+
+        policy = get_scheduler()
+        if policy is not None:
+            metadata['sched_policy'] = policy
+        nice = get_nice()
+        if nice is not None:
+            metadata['nice'] = nice
+        metadata['mlock'] = 'enabled' if self._memory_locked else 'disabled'
+
     def _run_bench(self, metadata, sample_func, inner_loops, loops, nsample,
                    is_warmup=False, is_calibrate=False, calibrate=False):
         unit = metadata.get('unit')
@@ -330,11 +990,18 @@ class Runner:
         index = 1
         if not inner_loops:
             inner_loops = 1
+        # Calibration: the number of loops is extrapolated from the raw sample
+        # to reach min_time. If the predicted number of loops is not enough
+        # (non-linear code), fall back to doubling the number of loops.
+        predicted = False
+        doubling = False
+        max_time_warned = False
         while True:
             if index > nsample:
                 break
 
-            raw_sample = sample_func(loops)
+            sample_info = self._run_sample(sample_func, loops)
+            raw_sample, gc_collections, hook_metadata = sample_info
             raw_sample = float(raw_sample)
             sample = raw_sample / (loops * inner_loops)
             if is_warmup:
@@ -350,6 +1017,26 @@ class Runner:
             else:
                 samples.append(value)
 
+            if gc_collections is not None and not is_warmup:
+                for generation, count in enumerate(gc_collections):
+                    key = 'gc_collections_gen%s' % generation
+                    metadata[key] = metadata.get(key, 0) + count
+            if hook_metadata is not None and not is_warmup:
+                for key, value in hook_metadata.items():
+                    key = METADATA_PREFIX + key
+                    metadata[key] = metadata.get(key, 0) + value
+
+            if args.stream and args.pipe is not None:
+                event = {'event': sample_name.lower(),
+                         'index': index,
+                         'loops': loops,
+                         'raw_sample': raw_sample}
+                if gc_collections is not None:
+                    event['gc_collections'] = gc_collections
+                if hook_metadata is not None:
+                    event['hook_metadata'] = hook_metadata
+                self._write_event(event)
+
             if args.verbose:
                 text = format_sample(unit, sample)
                 if is_warmup or is_calibrate:
@@ -359,13 +1046,40 @@ class Runner:
                                format_sample(unit, raw_sample)))
                 print("%s %s: %s" % (sample_name, index, text))
 
+            if (calibrate and raw_sample > args.max_time
+               and not max_time_warned):
+                print("WARNING: calibration raw sample (%s) is longer than "
+                      "max_time (%s)"
+                      % (format_sample(unit, raw_sample),
+                         format_timedelta(args.max_time)))
+                max_time_warned = True
+
             if calibrate and raw_sample < args.min_time:
-                loops *= 2
-                if loops > 2 ** 32:
-                    raise ValueError("error in calibration, loops is "
-                                     "too big: %s" % loops)
-                # need more samples for the calibration
-                nsample += 1
+                if predicted:
+                    doubling = True
+                if doubling:
+                    factor = 2
+                else:
+                    factor = CALIBRATION_MAX_FACTOR
+                    if raw_sample > 0:
+                        factor = min(args.min_time / raw_sample, factor)
+                    # round to the next power of 2
+                    factor = 2 ** int(math.ceil(math.log(factor, 2)))
+                # the expected raw sample must not exceed max_time
+                while factor > 1 and raw_sample * factor > args.max_time:
+                    factor //= 2
+                if not doubling:
+                    predicted = (factor < CALIBRATION_MAX_FACTOR)
+                if factor > 1:
+                    loops *= factor
+                    if loops > 2 ** 32:
+                        raise ValueError("error in calibration, loops is "
+                                         "too big: %s" % loops)
+                    # need more samples for the calibration
+                    nsample += 1
+                elif args.verbose:
+                    print("Calibration: stop, doubling the number of loops "
+                          "would exceed max_time")
 
             index += 1
 
@@ -377,6 +1091,110 @@ class Runner:
         # Run collects metadata
         return (loops, samples)
 
+    def _call_sample_func(self, sample_func, loops):
+        # Call hooks just before and after the sample: return (raw_sample,
+        # hook_metadata) where hook_metadata is a dict or None
+        hooks = self._hooks
+        if hooks is None:
+            return (sample_func(loops), None)
+
+        hooks.before_sample()
+        raw_sample = sample_func(loops)
+        return (raw_sample, hooks.after_sample())
+
+    def _run_sample(self, sample_func, loops):
+        # Compute a raw sample with the --gc policy: return (raw_sample,
+        # gc_collections, hook_metadata) where gc_collections is the list of
+        # the number of collections per generation during the sample, or None
+        policy = self.args.gc
+        if not policy:
+            raw_sample, hook_metadata = self._call_sample_func(sample_func,
+                                                               loops)
+            return (raw_sample, None, hook_metadata)
+
+        if policy == 'collect-before-sample':
+            gc.collect()
+        elif policy == 'disable':
+            gc_enabled = gc.isenabled()
+            gc.disable()
+        elif policy == 'freeze':
+            # move all objects to the permanent generation: they are
+            # ignored by collections
+            gc.freeze()
+
+        # gc.get_stats() requires Python 3.4
+        get_stats = getattr(gc, 'get_stats', None)
+        if get_stats is not None:
+            before = [stats['collections'] for stats in get_stats()]
+        try:
+            raw_sample, hook_metadata = self._call_sample_func(sample_func,
+                                                               loops)
+        finally:
+            if policy == 'disable':
+                if gc_enabled:
+                    gc.enable()
+            elif policy == 'freeze':
+                gc.unfreeze()
+
+        if get_stats is None:
+            return (raw_sample, None, hook_metadata)
+        after = [stats['collections'] for stats in get_stats()]
+        gc_collections = [count2 - count1
+                          for count1, count2 in zip(before, after)]
+        return (raw_sample, gc_collections, hook_metadata)
+
+    def _get_pipe_file(self):
+        if self._pipe_file is None:
+            fd = self.args.pipe
+            if six.PY3:
+                self._pipe_file = open(fd, "w", encoding="utf8")
+            else:
+                self._pipe_file = os.fdopen(fd, "w")
+        return self._pipe_file
+
+    def _write_event(self, event):
+        # --stream mode: write an event as a JSON line into the pipe
+        wpipe = self._get_pipe_file()
+        wpipe.write(json.dumps(event, sort_keys=True) + "\n")
+        wpipe.flush()
+
+    def _write_start_event(self, metadata, inner_loops):
+        # --stream mode: send the metadata of the run before the first
+        # sample, so the master can build a partial run from the events
+        # if the worker fails
+        from perf._collect_metadata import collect_metadata
+
+        run_metadata = {}
+        collect_metadata(run_metadata)
+        run_metadata.update(metadata)
+        if inner_loops is not None:
+            run_metadata['inner_loops'] = inner_loops
+        self._write_event({'event': 'start', 'metadata': run_metadata})
+
+    def _write_task_count(self):
+        # Worker of the --count-tasks mode: called at exit
+        if not self.args.count_tasks:
+            # the count was already written
+            return
+        self.args.count_tasks = False
+
+        wpipe = self._get_pipe_file()
+        ntask = self._worker_task - self._skipped_tasks
+        wpipe.write(json.dumps({'tasks': ntask}) + "\n")
+        wpipe.close()
+        self._pipe_file = None
+
+    def _wait_start(self):
+        # Worker of Runner.bench_scaling_func(): notify the master that the
+        # worker is ready and wait until the master starts all workers
+        fd = self.args.start_pipe
+        if fd is None:
+            return
+
+        self._write_event({'event': 'ready'})
+        os.read(fd, 1)
+        os.close(fd)
+
     def _calibrate(self, sample_func, metadata=None, inner_loops=None):
         if metadata is None:
             metadata = {}
@@ -391,8 +1209,11 @@ class Runner:
 
         calibrate = (not loops)
         if calibrate:
+            start_time = perf.monotonic_clock()
             loops, calibrate_warmups = self._calibrate(sample_func, metadata,
                                                        inner_loops)
+            metadata['calibration_steps'] = len(calibrate_warmups)
+            metadata['calibration_time'] = perf.monotonic_clock() - start_time
         else:
             if perf.python_has_jit():
                 # With a JIT, continue to calibrate during warmup
@@ -460,17 +1281,38 @@ class Runner:
 
         return (loops, warmups, samples)
 
-    def _worker(self, name, sample_func, inner_loops, func_metadata):
+    def _worker(self, name, sample_func, inner_loops, func_metadata,
+                display=True):
         metadata = dict(self.metadata, name=name)
         if func_metadata:
             metadata.update(func_metadata)
+        if self.args.gc:
+            metadata['gc_policy'] = self.args.gc
+        if self.args.randomize_env:
+            # the hash seed is stored in python_hash_seed by collect_metadata()
+            metadata['env_padding'] = len(os.environ.get(ENV_PADDING_VAR, ''))
         start_time = perf.monotonic_clock()
 
         self._cpu_affinity()
+        self._set_scheduling(metadata)
+        self._wait_start()
+
+        if self._hook_classes and self._hooks is None:
+            self._hooks = HookManager(self._hook_classes)
+        if self._hooks is not None:
+            self._hooks.before_run(metadata)
+        if (self.args.stream and self.args.pipe is not None
+           and not(self.args.tracemalloc or self.args.track_memory)):
+            self._write_start_event(metadata, inner_loops)
 
         loops, warmups, samples = self._worker_run_bench_mem(metadata,
                                                              sample_func,
                                                              inner_loops)
+        if self._hooks is not None:
+            self._hooks.after_run(metadata)
+        if func_metadata:
+            # sample_func can update metadata, ex: Runner.bench_command()
+            metadata.update(func_metadata)
 
         duration = perf.monotonic_clock() - start_time
         metadata['duration'] = duration
@@ -480,12 +1322,63 @@ class Runner:
 
         run = perf.Run(samples, warmups=warmups, metadata=metadata)
         bench = perf.Benchmark((run,))
-        self._display_result(bench, checks=False)
+        if display:
+            self._display_result(bench, checks=False)
         return bench
 
-    def _check_worker_task(self):
+    def _read_pool_command(self):
+        # Worker of the --pool mode: get the current command of the master
+        if self._pool_command is None:
+            if self._pool_command_file is None:
+                fd = self.args.pool_pipe
+                if six.PY3:
+                    self._pool_command_file = open(fd, "r", encoding="utf8")
+                else:
+                    self._pool_command_file = os.fdopen(fd, "r")
+
+            line = self._pool_command_file.readline()
+            if not line:
+                # the master closed the pipe: no more task for this worker
+                sys.exit(0)
+            self._pool_command = json.loads(line)
+        return self._pool_command
+
+    def _select_benchmark(self, name):
+        # --benchmark and --exclude options
+        args = self.args
+        if args.benchmark is not None and not args.benchmark.search(name):
+            return False
+        if args.exclude is not None and args.exclude.search(name):
+            return False
+        return True
+
+    def _check_worker_task(self, name):
         args = self.parse_args()
 
+        if not self._select_benchmark(name):
+            # Skip the benchmark in the master and in workers to keep
+            # the numbering of worker tasks
+            if args.verbose and not args.worker:
+                print("Skip benchmark %s" % name)
+            self._skipped_tasks += 1
+            self._worker_task += 1
+            return False
+
+        if args.count_tasks:
+            # --time-budget: only count benchmark tasks
+            self._worker_task += 1
+            return False
+
+        if args.pool_pipe is not None:
+            command = self._read_pool_command()
+            if command['task'] != self._worker_task:
+                # Skip the benchmark if it's not the requested task
+                self._worker_task += 1
+                return False
+
+            args.loops = command['loops']
+            return True
+
         if args.worker_task is None:
             return True
 
@@ -501,11 +1394,43 @@ class Runner:
             raise ValueError("name must be a non-empty string")
 
         args = self.parse_args()
+        if self._plan_suite is not None:
+            # --plan: don't run the benchmark
+            self._plan_benchmark(name)
+            self._worker_task += 1
+            return None
+
+        if args.interleave:
+            # benchmarks are only run at exit, once all benchmarks
+            # of the script are known
+            if not self._interleave_tasks:
+                atexit.register(self._run_interleaved)
+            self._interleave_tasks.append((name, sample_func, inner_loops,
+                                           metadata))
+            self._worker_task += 1
+            return None
+
         try:
             if args.worker:
                 bench = self._worker(name, sample_func, inner_loops, metadata)
+                # the command of the --pool mode is done
+                self._pool_command = None
             else:
-                bench = self._master()
+                if args.fork and sample_func is not None:
+                    self._fork_task = (name, sample_func, inner_loops,
+                                       metadata)
+                start_time = perf.monotonic_clock()
+                try:
+                    bench = self._master(name)
+                finally:
+                    self._fork_task = None
+                if args.cold_start and not self._scaling_processes:
+                    self._master_cold_start(name)
+                if args.eta:
+                    self._bench_durations.append(perf.monotonic_clock()
+                                                 - start_time)
+                    if not args.quiet and not args.verbose:
+                        self._display_script_eta()
         except KeyboardInterrupt:
             what = "Benchmark worker" if args.worker else "Benchmark"
             print("%s interrupted: exit" % what, file=sys.stderr)
@@ -514,6 +1439,61 @@ class Runner:
         self._worker_task += 1
         return bench
 
+    def _plan_duration(self, bench, nprocess):
+        # --plan: estimated duration of a benchmark run with nprocess worker
+        # processes, from the durations of the runs of a previous result
+        runs = bench.get_runs()
+        duration = math.fsum(run._get_duration() for run in runs
+                             if run._is_calibration())
+        durations = [run._get_duration() for run in runs
+                     if not run._is_calibration()]
+        if durations:
+            duration += (statistics.mean(durations) * nprocess
+                         / self.args.jobs)
+        return duration
+
+    def _plan_benchmark(self, name):
+        args = self.args
+        if args.target_ci:
+            nprocess = args.max_processes
+        else:
+            nprocess = args.processes
+        tasks = [(name, nprocess)]
+        if args.cold_start and not self._scaling_processes:
+            tasks.append((COLD_START_NAME % name,
+                          args.processes * args.samples))
+
+        if not self._plan_durations:
+            atexit.register(self._display_plan)
+
+        names = self._plan_suite.get_benchmark_names()
+        for task_name, nprocess in tasks:
+            if task_name in names:
+                bench = self._plan_suite.get_benchmark(task_name)
+                duration = self._plan_duration(bench, nprocess)
+                print("%s: %s" % (task_name, format_seconds(duration)))
+            else:
+                duration = None
+                print("%s: unknown duration" % task_name)
+            self._plan_durations.append((task_name, duration))
+        sys.stdout.flush()
+
+    def _display_plan(self):
+        # --plan: called at exit
+        durations = [duration for name, duration in self._plan_durations
+                     if duration is not None]
+        total = math.fsum(durations)
+        if self.args.time_budget:
+            total = min(total, self.args.time_budget)
+        print()
+        print("Estimated duration: %s (%s)"
+              % (format_seconds(total),
+                 format_number(len(self._plan_durations), 'benchmark')))
+        unknown = len(self._plan_durations) - len(durations)
+        if unknown:
+            print("WARNING: %s not found in %s"
+                  % (format_number(unknown, 'benchmark'), self.args.plan))
+
     def _no_keyword_argument(self, kwargs):
         if not kwargs:
             return
@@ -534,7 +1514,7 @@ class Runner:
         metadata = kwargs.pop('metadata', None)
         self._no_keyword_argument(kwargs)
 
-        if not self._check_worker_task():
+        if not self._check_worker_task(name):
             return None
 
         if not args:
@@ -550,11 +1530,28 @@ class Runner:
 
         inner_loops = kwargs.pop('inner_loops', None)
         metadata = kwargs.pop('metadata', None)
+        inputs = kwargs.pop('inputs', None)
+        input_pool_size = kwargs.pop('input_pool_size', None)
         self._no_keyword_argument(kwargs)
 
-        if not self._check_worker_task():
+        if inputs is not None and args:
+            raise ValueError("inputs is incompatible with func arguments")
+        if input_pool_size is not None:
+            if inputs is None:
+                raise ValueError("input_pool_size requires inputs")
+            if (not isinstance(input_pool_size, six.integer_types)
+               or input_pool_size < 1):
+                raise ValueError("input_pool_size must be an integer >= 1, "
+                                 "got %r" % (input_pool_size,))
+
+        if not self._check_worker_task(name):
             return None
 
+        if inputs is not None:
+            sample_func = self._inputs_sample_func(func, inputs,
+                                                   input_pool_size)
+            return self._main(name, sample_func, inner_loops, metadata)
+
         def sample_func(loops):
             # use fast local variables
             local_timer = perf.perf_counter
@@ -593,10 +1590,169 @@ class Runner:
 
         return self._main(name, sample_func, inner_loops, metadata)
 
+    def _inputs_sample_func(self, func, inputs, pool_size=None):
+        if pool_size is None:
+            pool_size = INPUT_POOL_SIZE
+
+        def sample_func(loops):
+            # create arguments outside the timed region, the size of the pool
+            # is bounded to limit the memory usage
+            pool = _get_input_pool(inputs, min(loops, pool_size))
+            nrepeat, remainder = divmod(loops, len(pool))
+            range_it = range(nrepeat)
+            pool_tail = pool[:remainder]
+
+            # use fast local variables
+            local_timer = perf.perf_counter
+            local_func = func
+
+            t0 = local_timer()
+            for _ in range_it:
+                for local_args in pool:
+                    local_func(*local_args)
+            for local_args in pool_tail:
+                local_func(*local_args)
+            dt = local_timer() - t0
+
+            # subtract the overhead of the iteration on the pool, measured
+            # after the benchmark to not warm up the CPU caches
+            t0 = local_timer()
+            for _ in range_it:
+                for local_args in pool:
+                    pass
+            for local_args in pool_tail:
+                pass
+            overhead = local_timer() - t0
+
+            if overhead >= dt:
+                # timer noise: the overhead cannot be estimated
+                return dt
+            return dt - overhead
+
+        return sample_func
+
+    def bench_threaded_func(self, name, func, *args, **kwargs):
+        """Benchmark func(*args) run concurrently in 1, 2, ... threads.
+
+        Each number of threads is a different benchmark. Return the list of
+        benchmarks.
+        """
+        inner_loops = kwargs.pop('inner_loops', None)
+        metadata = kwargs.pop('metadata', None)
+        threads = kwargs.pop('threads', None)
+        self._no_keyword_argument(kwargs)
+
+        if threads is None:
+            threads = get_logical_cpu_count() or 1
+        if isinstance(threads, six.integer_types):
+            threads = range(1, threads + 1)
+        if not inner_loops:
+            inner_loops = 1
+
+        benchmarks = []
+        for nthread in threads:
+            if not self._check_worker_task(THREADS_NAME % (name, nthread)):
+                continue
+
+            def sample_func(loops, nthread=nthread):
+                return _bench_threads(nthread, func, args, loops)
+
+            thread_metadata = dict(metadata or {}, threads=nthread)
+            # normalize timings per function call: each thread calls func()
+            bench = self._main(THREADS_NAME % (name, nthread), sample_func,
+                               inner_loops * nthread, thread_metadata)
+            benchmarks.append(bench)
+        return benchmarks
+
+    def bench_scaling_func(self, name, func, *args, **kwargs):
+        """Benchmark func(*args) run in 1, 2, 4, ... worker processes in
+        parallel, each process pinned to a different CPU.
+
+        Each number of processes is a different benchmark. Return the list of
+        benchmarks.
+        """
+        inner_loops = kwargs.pop('inner_loops', None)
+        metadata = kwargs.pop('metadata', None)
+        processes = kwargs.pop('processes', None)
+        self._no_keyword_argument(kwargs)
+
+        if self.parse_args().interleave:
+            raise ValueError("bench_scaling_func() is incompatible "
+                             "with --interleave")
+
+        if processes is None:
+            processes = get_logical_cpu_count() or 1
+        if isinstance(processes, six.integer_types):
+            max_processes = processes
+            processes = []
+            nprocess = 1
+            while nprocess < max_processes:
+                processes.append(nprocess)
+                nprocess *= 2
+            processes.append(max_processes)
+
+        benchmarks = []
+        for nprocess in processes:
+            name_processes = PROCESSES_NAME % (name, nprocess)
+            if not self._check_worker_task(name_processes):
+                continue
+
+            if not self.args.worker:
+                if not self._get_cpus(nprocess, allow_siblings=True):
+                    if not self.args.quiet:
+                        print("WARNING: skip %s: unable to get %s CPUs"
+                              % (name_processes, nprocess))
+                    # keep the numbering of worker tasks
+                    self._worker_task += 1
+                    continue
+                # the master runs nprocess workers in parallel
+                self._scaling_processes = nprocess
+            process_metadata = dict(metadata or {},
+                                    parallel_processes=nprocess)
+            try:
+                bench = self.bench_func(name_processes, func, *args,
+                                        inner_loops=inner_loops,
+                                        metadata=process_metadata)
+            finally:
+                self._scaling_processes = None
+            benchmarks.append(bench)
+        return benchmarks
+
+    def bench_async_func(self, name, coro_func, *args, **kwargs):
+        """Benchmark await coro_func(*args) in an asyncio event loop."""
+
+        inner_loops = kwargs.pop('inner_loops', None)
+        metadata = kwargs.pop('metadata', None)
+        loop_factory = kwargs.pop('loop_factory', None)
+        self._no_keyword_argument(kwargs)
+
+        if self.parse_args().interleave:
+            # the event loop is closed before the benchmark is run
+            raise ValueError("bench_async_func() is incompatible "
+                             "with --interleave")
+
+        if not self._check_worker_task(name):
+            return None
+
+        from perf._async import bench_async_func
+        return bench_async_func(self, name, coro_func, args,
+                                inner_loops=inner_loops,
+                                func_metadata=metadata,
+                                loop_factory=loop_factory)
+
+    def bench_command(self, name, command):
+        """Benchmark the command: time from process spawn to process exit."""
+
+        if not self._check_worker_task(name):
+            return None
+
+        from perf._command import bench_command
+        return bench_command(self, name, command)
+
     def timeit(self, name, stmt, setup="pass", inner_loops=None,
                duplicate=None, metadata=None, globals=None):
 
-        if not self._check_worker_task():
+        if not self._check_worker_task(name):
             return None
 
         from perf._timeit import bench_timeit
@@ -607,73 +1763,658 @@ class Runner:
                             func_metadata=metadata,
                             globals=globals)
 
-    def _worker_cmd(self, calibrate, wpipe):
+    def _worker_cmd(self, calibrate, wpipe, affinity=None, pool_pipe=None,
+                    count_tasks=False):
         args = self.args
 
         cmd = [args.python]
         cmd.extend(self._program_args)
-        cmd.extend(('--worker', '--pipe', str(wpipe),
-                    '--worker-task=%s' % self._worker_task,
-                    '--samples', str(args.samples),
+        cmd.extend(('--worker', '--pipe', str(wpipe)))
+        if pool_pipe is not None:
+            cmd.append('--pool-pipe=%s' % pool_pipe)
+        elif not args.interleave:
+            cmd.append('--worker-task=%s' % self._worker_task)
+        cmd.extend(('--samples', str(args.samples),
                     '--warmups', str(args.warmups),
                     '--loops', str(args.loops),
-                    '--min-time', str(args.min_time)))
+                    '--min-time', str(args.min_time),
+                    '--max-time', str(args.max_time)))
         if calibrate:
             cmd.append('--calibrate')
+        if count_tasks:
+            cmd.append('--count-tasks')
+        if args.interleave:
+            cmd.append('--interleave')
+            if self._task_loops is not None and not calibrate:
+                cmd.append('--task-loops=%s'
+                           % ','.join(map(str, self._task_loops)))
+        if args.benchmark is not None:
+            cmd.append('--benchmark=%s' % args.benchmark.pattern)
+        if args.exclude is not None:
+            cmd.append('--exclude=%s' % args.exclude.pattern)
         if args.verbose:
             cmd.append('-' + 'v' * args.verbose)
-        if args.affinity:
-            cmd.append('--affinity=%s' % args.affinity)
+        if affinity is None:
+            affinity = args.affinity
+        if affinity:
+            cmd.append('--affinity=%s' % affinity)
         if args.tracemalloc:
             cmd.append('--tracemalloc')
         if args.track_memory:
             cmd.append('--track-memory')
+        if args.stream:
+            cmd.append('--stream')
+        if args.gc:
+            cmd.append('--gc=%s' % args.gc)
+        if args.sched:
+            cmd.append('--sched=%s' % args.sched)
+        if args.nice is not None:
+            cmd.append('--nice=%s' % args.nice)
+        if args.mlock:
+            cmd.append('--mlock')
+        if args.randomize_env:
+            cmd.append('--randomize-env')
+        for name in args.hook:
+            cmd.append('--hook=%s' % name)
 
         if self._add_cmdline_args:
             self._add_cmdline_args(cmd, self.args)
 
         return cmd
 
-    def _spawn_worker(self, calibrate=False):
+    def _start_worker(self, calibrate=False, cpu=None, start_pipe=None,
+                      count_tasks=False):
+        # Spawn a worker process: return (proc, cmd, rfile) where rfile is
+        # the read end of the worker pipe
         rpipe, wpipe = pipe_cloexec()
         if six.PY3:
             rfile = open(rpipe, "r", encoding="utf8")
         else:
             rfile = os.fdopen(rpipe, "r")
 
-        with rfile:
+        if (self._fork_task is not None and not self._scaling_processes
+           and not count_tasks):
             try:
-                cmd = self._worker_cmd(calibrate, wpipe)
-                env = create_environ(self.args.inherit_environ,
-                                     self.args.locale)
-
-                kw = {}
-                if sys.version_info >= (3, 2):
-                    kw['pass_fds'] = [wpipe]
-                proc = subprocess.Popen(cmd, env=env, **kw)
+                proc = self._fork_worker(calibrate, rpipe, wpipe)
+            except BaseException:
+                rfile.close()
+                raise
             finally:
                 os.close(wpipe)
+            return (proc, [sys.executable], rfile)
+
+        try:
+            if cpu is not None:
+                affinity = str(cpu)
+            else:
+                affinity = None
+            cmd = self._worker_cmd(calibrate, wpipe, affinity,
+                                   count_tasks=count_tasks)
+            pass_fds = [wpipe]
+            if start_pipe is not None:
+                cmd.append('--start-pipe=%s' % start_pipe)
+                pass_fds.append(start_pipe)
+            env = create_environ(self.args.inherit_environ,
+                                 self.args.locale,
+                                 self.args.randomize_env)
+
+            kw = {}
+            if sys.version_info >= (3, 2):
+                kw['pass_fds'] = pass_fds
+            proc = subprocess.Popen(cmd, env=env, **kw)
+        except BaseException:
+            rfile.close()
+            raise
+        finally:
+            os.close(wpipe)
+        return (proc, cmd, rfile)
+
+    def _fork_worker(self, calibrate, rpipe, wpipe):
+        # --fork mode: the child process runs the benchmark of the current
+        # task, modules imported by the master are already loaded
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            return _ForkedProcess(pid)
+
+        # child process
+        exitcode = 1
+        try:
+            os.close(rpipe)
+            self._run_forked_worker(calibrate, wpipe)
+            exitcode = 0
+        except SystemExit as exc:
+            if exc.code is None:
+                exitcode = 0
+            elif isinstance(exc.code, int):
+                exitcode = exc.code
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # don't run atexit callbacks and cleanup code of the master
+            os._exit(exitcode)
+
+    def _run_forked_worker(self, calibrate, wpipe):
+        name, sample_func, inner_loops, metadata = self._fork_task
+        self._fork_task = None
+        self._pool = None
+        self._pipe_file = None
+
+        # Similar to the command line of a spawned worker
+        args = copy.copy(self.args)
+        args.worker = True
+        args.pipe = wpipe
+        args.output = None
+        args.append = None
+        args.quiet = True
+        args.verbose = False
+        if calibrate:
+            args.calibrate = True
+            args.loops = 0
+            args.warmups = 0
+            args.samples = 0
+        self.args = args
+
+        # The hash seed and the address space layout are inherited from the
+        # master, but reseed the random module
+        random.seed()
+        self.metadata = dict(self.metadata, worker_mode='fork')
+
+        self._worker(name, sample_func, inner_loops, metadata)
 
+    def _spawn_worker(self, calibrate=False, cpu=None):
+        proc, cmd, rfile = self._start_worker(calibrate, cpu)
+        stream_run = _StreamRun()
+        try:
+            with rfile:
+                with popen_killer(proc):
+                    if self.args.stream or self.args.worker_timeout:
+                        bench_json = self._read_stream(_PipeReader(rfile),
+                                                       stream_run)
+                    else:
+                        bench_json = rfile.read()
+                    rfile.close()
+
+                    exitcode = proc.wait()
+
+            if exitcode:
+                raise RuntimeError("%s failed with exit code %s"
+                                   % (cmd[0], exitcode))
+        except RuntimeError as exc:
+            metadata = None
+            if cpu is not None:
+                metadata = {'cpu': cpu}
+            raise _WorkerError(str(exc), stream_run.get_run(metadata))
+
+        suite = _load_suite_from_pipe(bench_json)
+        if cpu is not None:
+            _update_suite_metadata(suite, {'cpu': cpu})
+        return suite
+
+    def _count_tasks(self):
+        # --time-budget: run the script in a worker which only counts its
+        # benchmark tasks. Return None on error.
+        proc, cmd, rfile = self._start_worker(count_tasks=True)
+        with rfile:
             with popen_killer(proc):
-                bench_json = rfile.read()
+                output = rfile.read()
                 rfile.close()
+                exitcode = proc.wait()
+
+        if exitcode or not output:
+            return None
+        return json.loads(output)['tasks']
+
+    def _get_task_count(self):
+        # Number of benchmark tasks of the script, counted once: None if
+        # unknown
+        if not self._tasks_counted:
+            self._task_count = self._count_tasks()
+            self._tasks_counted = True
+        return self._task_count
+
+    def _get_bench_deadline(self):
+        # --time-budget: share the remaining time between the remaining
+        # benchmark tasks
+        if self._budget_start is None:
+            self._budget_start = perf.monotonic_clock()
+            self._get_task_count()
+
+        now = perf.monotonic_clock()
+        remaining = self._budget_start + self.args.time_budget - now
+        ntask = 1
+        if self._task_count:
+            done = self._worker_task - self._skipped_tasks
+            ntask = max(self._task_count - done, 1)
+        return now + max(remaining, 0.0) / ntask
+
+    def _get_script_eta(self, bench_eta, bench_duration=None):
+        # --eta: estimated remaining duration of the script, bench_eta is the
+        # remaining duration of the current benchmark and bench_duration its
+        # estimated total duration. Return None if unknown.
+        task_count = self._get_task_count()
+        if task_count is None:
+            return None
+        # the current benchmark is not counted in done tasks
+        done = self._worker_task - self._skipped_tasks
+        ntask = max(task_count - done - 1, 0)
+        if self._bench_durations:
+            bench_duration = statistics.mean(self._bench_durations)
+        elif bench_duration is None:
+            return None
+        return bench_eta + ntask * bench_duration
+
+    def _display_eta(self, start, worker_times, nworker, deadline=None):
+        # --eta: display the estimated remaining duration of the benchmark,
+        # where nworker workers remain to be spawned, and of the script
+        now = perf.monotonic_clock()
+        bench_eta = nworker * statistics.mean(worker_times)
+        if deadline is not None:
+            bench_eta = min(bench_eta, max(deadline - now, 0.0))
+        text = "ETA: benchmark %s" % format_seconds(bench_eta)
+        script_eta = self._get_script_eta(bench_eta,
+                                          now - start + bench_eta)
+        if script_eta is not None:
+            text += ", script %s" % format_seconds(script_eta)
+        print(text)
+
+    def _display_script_eta(self):
+        # --eta: called when a benchmark completed
+        script_eta = self._get_script_eta(0.0)
+        if script_eta is None:
+            return
+        done = self._worker_task - self._skipped_tasks + 1
+        print("ETA: script %s (%s/%s benchmarks)"
+              % (format_seconds(script_eta), done, self._task_count))
+
+    def _wait_ready(self, reader):
+        # Runner.bench_scaling_func(): wait until the worker is ready
+        timeout = self.args.stall_timeout
+        while True:
+            line = reader.readline(timeout)
+            if line is None:
+                raise RuntimeError("worker stalled: not ready after %s"
+                                   % format_timedelta(timeout))
+            if not line:
+                raise RuntimeError("worker exited before being ready")
+            data = json.loads(line)
+            if data.get('event') == 'ready':
+                return
+
+    def _spawn_scaling_workers(self, nprocess):
+        # Runner.bench_scaling_func(): run nprocess workers in parallel, each
+        # worker pinned to a different CPU, and start them at the same time.
+        # Return a suite with a single run aggregating the runs of workers.
+        cpus = self._get_cpus(nprocess, allow_siblings=True)
+        if not cpus:
+            raise RuntimeError("unable to get %s CPUs to run %s processes "
+                               "in parallel" % (nprocess, nprocess))
 
+        workers = []
+        try:
+            for cpu in cpus:
+                start_rpipe, start_wpipe = pipe_cloexec()
+                try:
+                    proc, cmd, rfile = self._start_worker(cpu=cpu,
+                                                          start_pipe=start_rpipe)
+                except BaseException:
+                    os.close(start_wpipe)
+                    raise
+                finally:
+                    os.close(start_rpipe)
+                workers.append((proc, cmd, rfile, _PipeReader(rfile),
+                                start_wpipe))
+
+            # start barrier: wait until all workers are ready
+            for proc, cmd, rfile, reader, start_wpipe in workers:
+                self._wait_ready(reader)
+            for proc, cmd, rfile, reader, start_wpipe in workers:
+                os.write(start_wpipe, b'x')
+
+            runs = []
+            for proc, cmd, rfile, reader, start_wpipe in workers:
+                bench_json = self._read_stream(reader)
                 exitcode = proc.wait()
+                if exitcode:
+                    raise RuntimeError("%s failed with exit code %s"
+                                       % (cmd[0], exitcode))
+                suite = _load_suite_from_pipe(bench_json)
+                bench = suite.get_benchmarks()[0]
+                runs.append(bench.get_runs()[-1])
+        finally:
+            for proc, cmd, rfile, reader, start_wpipe in workers:
+                if proc.returncode is None:
+                    proc.kill()
+                    proc.wait()
+                rfile.close()
+                os.close(start_wpipe)
 
-        if exitcode:
-            raise RuntimeError("%s failed with exit code %s"
-                               % (cmd[0], exitcode))
+        run = self._aggregate_scaling_runs(runs, cpus)
+        bench._replace_runs([run])
+        return suite
+
+    def _aggregate_scaling_runs(self, runs, cpus):
+        # Combine the runs of workers which ran in parallel: the sample is
+        # the time per function call for the throughput of all workers
+        nsample = min(len(run.samples) for run in runs)
+        samples = []
+        for index in range(nsample):
+            throughput = math.fsum(1.0 / run.samples[index] for run in runs)
+            samples.append(1.0 / throughput)
+
+        metadata = runs[0].get_metadata()
+        for name in ('cpu', 'cpu_affinity'):
+            metadata.pop(name, None)
+        durations = [run.get_metadata().get('duration') for run in runs]
+        durations = [duration for duration in durations
+                     if duration is not None]
+        if durations:
+            metadata['duration'] = max(durations)
+        metadata['parallel_cpus'] = format_cpu_list(cpus)
+
+        return runs[0]._replace(samples=samples, warmups=False,
+                                metadata=metadata)
+
+    def _read_stream(self, reader, stream_run=None):
+        # --stream mode: consume events of a worker until its result.
+        # Raise an exception if the worker stalls, if the --worker-timeout
+        # is exceeded or if the worker diverges (invalid raw sample, samples
+        # using a different number of loops): the caller kills it.
+        # Valid events are added to stream_run.
+        if stream_run is None:
+            stream_run = _StreamRun()
+        timeout = self.args.stall_timeout
+        worker_timeout = self.args.worker_timeout
+        if worker_timeout:
+            deadline = perf.monotonic_clock() + worker_timeout
+        events = collections.Counter()
+        sample_loops = None
+        while True:
+            line_timeout = timeout
+            if worker_timeout:
+                remaining = max(deadline - perf.monotonic_clock(), 0.0)
+                if line_timeout is None or remaining < line_timeout:
+                    line_timeout = remaining
+
+            line = reader.readline(line_timeout)
+            if line is None:
+                if worker_timeout and perf.monotonic_clock() >= deadline:
+                    raise RuntimeError("worker timed out after %s"
+                                       % format_timedelta(worker_timeout))
+                raise RuntimeError("worker stalled: no event since %s "
+                                   "(%s calibrations, %s warmups, "
+                                   "%s samples received)"
+                                   % (format_timedelta(timeout),
+                                      events['calibration'],
+                                      events['warmup'],
+                                      events['sample']))
+            if not line:
+                # end of file
+                return line
+
+            data = json.loads(line)
+            if 'event' not in data:
+                # the worker result
+                return line
+            event = data['event']
+            events[event] += 1
+
+            if event == 'start':
+                stream_run.add_event(data)
+                continue
+            if event not in ('calibration', 'warmup', 'sample'):
+                continue
+
+            # abort a diverging worker without waiting for its result
+            raw_sample = data.get('raw_sample')
+            if (not isinstance(raw_sample, six.integer_types + (float,))
+               or math.isnan(raw_sample) or math.isinf(raw_sample)
+               or raw_sample < 0):
+                raise RuntimeError("worker diverged: invalid raw sample "
+                                   "in %s %s: %r"
+                                   % (event, data.get('index'), raw_sample))
+            if event == 'sample':
+                if sample_loops is None:
+                    sample_loops = data['loops']
+                elif data['loops'] != sample_loops:
+                    raise RuntimeError("worker diverged: sample %s uses "
+                                       "%s loops, previous samples used %s"
+                                       % (data.get('index'), data['loops'],
+                                          sample_loops))
+
+            value = stream_run.add_event(data)
+            if self.args.verbose and value is not None:
+                print("Worker sample %s: %s"
+                      % (data.get('index'),
+                         format_sample(stream_run.get_unit(), value)))
+                sys.stdout.flush()
+
+    def _spawn_pool_worker(self):
+        command_rpipe, command_wpipe = pipe_cloexec()
+        result_rpipe, result_wpipe = pipe_cloexec()
+        if six.PY3:
+            command_file = open(command_wpipe, "w", encoding="utf8")
+            result_file = open(result_rpipe, "r", encoding="utf8")
+        else:
+            command_file = os.fdopen(command_wpipe, "w")
+            result_file = os.fdopen(result_rpipe, "r")
+
+        try:
+            cmd = self._worker_cmd(False, result_wpipe,
+                                   pool_pipe=command_rpipe)
+            env = create_environ(self.args.inherit_environ,
+                                 self.args.locale,
+                                 self.args.randomize_env)
+
+            kw = {}
+            if sys.version_info >= (3, 2):
+                kw['pass_fds'] = [result_wpipe, command_rpipe]
+            proc = subprocess.Popen(cmd, env=env, **kw)
+        except BaseException:
+            command_file.close()
+            result_file.close()
+            raise
+        finally:
+            os.close(result_wpipe)
+            os.close(command_rpipe)
+
+        worker = _PoolWorker(proc, cmd, command_file, result_file)
+        if self.args.stream or self.args.worker_timeout:
+            worker.reader = _PipeReader(result_file)
+        return worker
+
+    def _run_pool_task(self, index):
+        # Run the current benchmark in the index-th worker of the pool
+        if self._pool is None:
+            self._pool = {}
+            atexit.register(self._stop_pool)
+
+        worker = self._pool.get(index)
+        if worker is None:
+            worker = self._spawn_pool_worker()
+            self._pool[index] = worker
+
+        command = {'task': self._worker_task, 'loops': self.args.loops}
+        try:
+            bench_json = worker.run_task(command, self._read_stream)
+        except BaseException:
+            # the worker failed: spawn a new worker at the next task
+            del self._pool[index]
+            worker.stop()
+            raise
+
+        max_tasks = self.args.max_tasks_per_worker
+        if max_tasks and worker.ntask >= max_tasks:
+            # Replace the worker with a fresh process at the next task
+            del self._pool[index]
+            worker.stop()
 
         return _load_suite_from_pipe(bench_json)
 
-    def _display_result(self, bench, checks=True):
+    def _stop_pool(self):
+        if not self._pool:
+            return
+        for worker in self._pool.values():
+            worker.stop()
+        self._pool.clear()
+
+    def _spawn_parallel_workers(self, processes):
+        # Run workers in parallel: one thread per job, each job pinned to its
+        # own CPU. Yield (process, suite) in the order of processes, whatever
+        # the order in which workers complete, to get a deterministic order of
+        # runs.
+        todo = six.moves.queue.Queue()
+        for process in processes:
+            todo.put(process)
+        done = six.moves.queue.Queue()
+
+        def run_jobs(cpu):
+            while True:
+                try:
+                    process = todo.get_nowait()
+                except six.moves.queue.Empty:
+                    return
+
+                try:
+                    suite = self._retry_worker(self._spawn_worker, cpu=cpu)
+                except BaseException:
+                    done.put((process, None, sys.exc_info()))
+                    return
+                done.put((process, suite, None))
+
+        threads = []
+        for cpu in self._job_cpus[:len(processes)]:
+            thread = threading.Thread(target=run_jobs, args=(cpu,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            completed = {}
+            for process in processes:
+                while process not in completed:
+                    item_process, suite, exc_info = done.get()
+                    if exc_info is not None:
+                        six.reraise(*exc_info)
+                    completed[item_process] = suite
+                yield (process, completed.pop(process))
+        finally:
+            # don't spawn new workers, but wait until running workers complete
+            while True:
+                try:
+                    todo.get_nowait()
+                except six.moves.queue.Empty:
+                    break
+            for thread in threads:
+                thread.join()
+
+    def _iter_worker_suites(self, nprocess, calibrate, process=1):
+        # Yield (process, suite) where process starts at 1. The first worker
+        # is used to calibrate the benchmark if calibrate is true: the
+        # consumer must set args.loops before requesting the next worker.
+        if calibrate:
+            suite = self._retry_worker(self._spawn_worker, calibrate=True)
+            if self._scaling_processes:
+                cpus = self._get_cpus(self._scaling_processes)
+                _update_suite_metadata(suite,
+                                       {'parallel_cpus': format_cpu_list(cpus)})
+            yield (process, suite)
+            process += 1
+
+        processes = list(range(process, nprocess + 1))
+        if self._scaling_processes:
+            for process in processes:
+                suite = self._spawn_scaling_workers(self._scaling_processes)
+                yield (process, suite)
+        elif self.args.jobs > 1 and len(processes) > 1:
+            for item in self._spawn_parallel_workers(processes):
+                yield item
+        elif self.args.pool:
+            for index, process in enumerate(processes):
+                yield (process, self._retry_worker(self._run_pool_task, index))
+        else:
+            for process in processes:
+                cpu = self._get_rotated_cpu(process)
+                yield (process, self._retry_worker(self._spawn_worker,
+                                                   cpu=cpu))
+
+    def _retry_worker(self, spawn_func, *args, **kw):
+        # --max-retries: respawn a worker which failed. If all retries
+        # failed, return the partial run of the last attempt (--stream), or
+        # None to skip the process and return a partial benchmark: see
+        # _check_worker_success(). Without retries, and for the calibration
+        # worker, fail on the first error.
+        calibrate = kw.get('calibrate', False)
+        max_retries = self.args.max_retries
+        attempt = 0
+        while True:
+            try:
+                suite = spawn_func(*args, **kw)
+            except (RuntimeError, ValueError) as exc:
+                error = exc
+            else:
+                if not calibrate:
+                    self._worker_success = True
+                return suite
+
+            self._failed_attempts.append(str(error))
+            if attempt >= max_retries:
+                break
+            attempt += 1
+            if not self.args.quiet:
+                print("WARNING: worker failed: %s; retry (%s/%s)"
+                      % (error, attempt, max_retries))
+
+        if calibrate or not max_retries:
+            raise error
+
+        self._failed_processes.append(str(error))
+        partial_run = getattr(error, 'partial_run', None)
+        if partial_run is not None:
+            # --stream: keep the samples computed before the failure
+            if not self.args.quiet:
+                print("WARNING: worker failed: %s; keep its partial run "
+                      "(%s)" % (error, format_number(len(partial_run.samples),
+                                                     'sample')))
+            self._worker_success = True
+            return perf.BenchmarkSuite([perf.Benchmark([partial_run])])
+
+        if not self.args.quiet:
+            print("WARNING: worker failed: %s; give up the process" % error)
+        return None
+
+    def _check_worker_success(self):
+        # --max-retries: fail if all worker processes of the benchmark failed
+        if self._worker_success or not self._failed_processes:
+            return
+        raise RuntimeError("all worker processes failed, last error: %s"
+                           % self._failed_processes[-1])
+
+    def _display_result(self, bench, checks=True, append_output=False):
         args = self.args
 
         # Display the average +- stdev
         if self.args.quiet:
             checks = False
 
-        if args.pipe is not None:
+        if args.pipe is not None and (args.pool_pipe is not None
+                                      or args.stream
+                                      or self._pipe_file is not None):
+            wpipe = self._get_pipe_file()
+            try:
+                bench.dump(wpipe)
+            except IOError as exc:
+                if exc.errno != errno.EPIPE:
+                    raise
+                # ignore broken pipe error
+            if args.pool_pipe is None:
+                # --pool mode keeps the pipe open for the following tasks
+                wpipe.close()
+                self._pipe_file = None
+        elif args.pipe is not None:
             fd = args.pipe
             if six.PY3:
                 wpipe = open(fd, "w", encoding="utf8")
@@ -704,28 +2445,89 @@ class Runner:
             perf.add_runs(args.append, bench)
 
         if args.output:
-            if self._worker_task >= 1:
+            if self._worker_task >= 1 or append_output:
                 perf.add_runs(args.output, bench)
             else:
                 bench.dump(args.output)
 
-    def _spawn_workers(self, newline=True):
+    def _spawn_workers(self, newline=True, name=None):
         bench = None
         args = self.args
         verbose = args.verbose
         quiet = args.quiet
-        nprocess = args.processes
+        target_ci = args.target_ci
+        stop_reason = None
+        if target_ci:
+            nprocess = args.max_processes
+            stop_reason = 'max_processes'
+            ci_width = None
+        else:
+            nprocess = args.processes
+        deadline = None
+        if args.time_budget:
+            deadline = self._get_bench_deadline()
+        if args.eta:
+            # count tasks before spawning workers
+            self._get_task_count()
+            start_time = perf.monotonic_clock()
+            worker_times = []
         old_loops = self.args.loops
         need_calibration = (not args.loops)
-        if need_calibration:
-            nprocess += 1
-        calibrate = need_calibration
 
         if verbose and self._worker_task > 0:
             print()
 
-        for process in range(1, nprocess + 1):
-            suite = self._spawn_worker(calibrate)
+        del self._failed_attempts[:]
+        del self._failed_processes[:]
+        self._worker_success = False
+
+        cache_key = None
+        first_suites = []
+        self._rotate_offset = 0
+        if need_calibration and args.calibration_cache and name:
+            cache_key = self._calibration_cache_key(name)
+            cached_loops = self._get_cached_loops(cache_key)
+            if cached_loops:
+                # Run the first worker with the cached number of loops
+                args.loops = cached_loops
+                suite = self._retry_worker(self._spawn_worker,
+                                           cpu=self._get_rotated_cpu(1))
+                if suite is not None and self._check_cached_loops(suite):
+                    need_calibration = False
+                    first_suites.append((1, suite))
+                else:
+                    # the worker failed or the cached loops are out of
+                    # tolerance
+                    if verbose and suite is not None:
+                        print("Cached loops (%s) out of tolerance: "
+                              "recalibrate" % format_number(cached_loops))
+                    args.loops = old_loops
+
+        if need_calibration:
+            nprocess += 1
+            self._rotate_offset = 1
+        calibrate = need_calibration
+
+        worker_suites = self._iter_worker_suites(nprocess, calibrate,
+                                                 len(first_suites) + 1)
+        # --replace-outliers: processes waiting for a replacement worker
+        replacements = []
+        noutlier = 0
+        # process number of each run of bench
+        run_processes = []
+        early_checked = False
+        replacement_suites = self._iter_replacement_suites(replacements,
+                                                           nprocess)
+        last_time = perf.monotonic_clock()
+        for process, suite in itertools.chain(first_suites, worker_suites,
+                                              replacement_suites):
+            now = perf.monotonic_clock()
+            worker_time = now - last_time
+            last_time = now
+
+            if suite is None:
+                # the worker failed, even after retries
+                continue
 
             benchmarks = suite.get_benchmarks()
             if len(benchmarks) != 1:
@@ -741,6 +2543,9 @@ class Runner:
             elif not quiet:
                 print(".", end='')
 
+            if args.eta and not calibrate:
+                worker_times.append(worker_time)
+
             if calibrate:
                 # Use the first worker to calibrate the benchmark. Use a worker
                 # process rather than the main process because worker is a
@@ -749,17 +2554,102 @@ class Runner:
                 args.loops = first_run._get_loops()
                 if verbose:
                     print("Calibration: use %s loops" % format_number(args.loops))
+                if cache_key is not None:
+                    self._set_cached_loops(cache_key, args.loops)
             calibrate = False
 
+            score = None
+            if args.detect_outliers and bench is not None:
+                score = self._get_outlier_score(bench, worker_bench)
+                if score is not None:
+                    run = worker_bench.get_runs()[-1]
+                    run = run._update_metadata({'outlier_score':
+                                                round(score, 2)})
+                    worker_bench._replace_runs([run])
+
             if bench is not None:
                 bench.add_runs(worker_bench)
             else:
                 bench = worker_bench
+            run_processes.append(process)
+
+            if args.detect_outliers:
+                runs = bench.get_runs()
+                outliers = []
+                if not early_checked:
+                    early_outliers = self._get_early_outlier_scores(bench)
+                    if early_outliers is not None:
+                        early_checked = True
+                        outliers.extend(early_outliers)
+                for index, early_score in outliers:
+                    runs[index] = runs[index]._update_metadata(
+                        {'outlier_score': round(early_score, 2)})
+                if outliers:
+                    bench._replace_runs(runs)
+                if score is not None:
+                    outliers.append((len(runs) - 1, score))
+
+                for index, outlier_score in outliers:
+                    noutlier += 1
+                    if verbose:
+                        print("Process %s is an outlier (score: %.1f)"
+                              % (run_processes[index], outlier_score))
+                    # at most args.processes replacement workers
+                    if args.replace_outliers and noutlier <= args.processes:
+                        replacements.append(run_processes[index])
+
+            if args.eta and verbose and worker_times:
+                nworker = max(nprocess - process, 0) + len(replacements)
+                self._display_eta(start_time, worker_times, nworker, deadline)
 
             sys.stdout.flush()
 
+            if target_ci and bench.get_nsample():
+                ci_width = self._median_ci_width(bench)
+                nrun = len([run for run in bench.get_runs()
+                            if not run._is_calibration()])
+                if (ci_width is not None and ci_width <= target_ci
+                   and nrun >= MIN_ADAPTIVE_PROCESSES):
+                    stop_reason = 'target_ci'
+                    break
+
+            # --time-budget: stop if the next worker is expected to exceed
+            # the share of the benchmark, using the duration of the last
+            # worker as an estimation
+            if (args.time_budget and bench.get_nsample()
+               and (process < nprocess or replacements)
+               and now + worker_time > deadline):
+                stop_reason = 'time_budget'
+                break
+
         if not quiet and newline:
             print()
+        self._check_worker_success()
+
+        if stop_reason is not None:
+            metadata = {'stop_reason': stop_reason}
+            if target_ci and ci_width is not None:
+                metadata['median_ci'] = ci_width
+            bench.update_metadata(metadata)
+            if verbose and not target_ci:
+                print("Stop (%s) after %s"
+                      % (stop_reason, format_number(bench.get_nrun(), 'run')))
+            elif verbose:
+                if ci_width is not None:
+                    text = '%.1f%%' % (ci_width * 100)
+                else:
+                    text = 'not enough samples'
+                print("Stop (%s) after %s: median confidence interval: %s"
+                      % (stop_reason, format_number(bench.get_nrun(), 'run'),
+                         text))
+
+        if self._failed_attempts:
+            metadata = {'failed_attempts': len(self._failed_attempts)}
+            if self._failed_processes:
+                metadata['failed_processes'] = len(self._failed_processes)
+            bench.update_metadata(metadata)
+        if noutlier:
+            bench.update_metadata({'outlier_processes': noutlier})
 
         # restore the old value of loops, to recalibrate for the next
         # benchmark function if loops=0
@@ -767,7 +2657,348 @@ class Runner:
 
         return bench
 
-    def _master(self):
-        bench = self._spawn_workers()
+    def _get_outlier_score(self, bench, worker_bench):
+        # --detect-outliers: return the modified z-score of the median sample
+        # of the worker run if the run is an outlier, or None
+        run = worker_bench.get_runs()[-1]
+        if run._is_calibration():
+            return None
+
+        medians = [statistics.median(old_run.samples)
+                   for old_run in bench.get_runs()
+                   if not old_run._is_calibration()
+                   and not old_run._has_metadata('outlier_score')]
+        if len(medians) < MIN_OUTLIER_RUNS:
+            return None
+        return self._outlier_zscore(statistics.median(run.samples), medians)
+
+    def _outlier_zscore(self, median, medians):
+        # Modified z-score of median compared to medians, or None if it is
+        # not an outlier
+        min_mad = statistics.median(medians) * OUTLIER_MIN_MAD
+        score = robust_zscore(median, medians, min_mad)
+        if score is None or abs(score) <= OUTLIER_THRESHOLD:
+            return None
+        return score
+
+    def _get_early_outlier_scores(self, bench):
+        # --detect-outliers: the first MIN_OUTLIER_RUNS runs are not checked
+        # when they are added, check them once enough runs are available.
+        # Return None if there are not enough runs yet, or a list of
+        # (index, score) where index is the index of an outlier run in
+        # bench.get_runs().
+        runs = bench.get_runs()
+        indexes = [index for index, run in enumerate(runs)
+                   if not run._is_calibration()]
+        medians = dict((index, statistics.median(runs[index].samples))
+                       for index in indexes
+                       if not runs[index]._has_metadata('outlier_score'))
+        if len(medians) <= MIN_OUTLIER_RUNS:
+            return None
+
+        outliers = []
+        for index in indexes[:MIN_OUTLIER_RUNS]:
+            others = [median for other, median in medians.items()
+                      if other != index]
+            score = self._outlier_zscore(medians[index], others)
+            if score is not None:
+                outliers.append((index, score))
+        return outliers
+
+    def _iter_replacement_suites(self, replacements, nprocess):
+        # --replace-outliers: spawn a worker for each outlier process,
+        # replacements is filled by the consumer
+        process = nprocess
+        while replacements:
+            replacements.pop(0)
+            process += 1
+            if self._scaling_processes:
+                suite = self._spawn_scaling_workers(self._scaling_processes)
+            else:
+                suite = self._retry_worker(self._spawn_worker,
+                                           cpu=self._get_rotated_cpu(process))
+            yield (process, suite)
+
+    def _median_ci_width(self, bench):
+        # Relative width of the confidence interval of the median
+        interval = median_confidence_interval(bench.get_samples())
+        if interval is None:
+            return None
+        low, high = interval
+        return (high - low) / bench.median()
+
+    def _calibration_cache_key(self, name):
+        # The number of loops depends on the benchmark, the Python executable,
+        # the perf version and the host
+        key = [name, self.args.python, perf.__version__,
+               platform.node(), platform.machine()]
+        return json.dumps(key)
+
+    def _load_calibration_cache(self, warn=True):
+        # Return an empty cache if the file is missing or invalid: the
+        # benchmark is calibrated and the file is written again
+        filename = self.args.calibration_cache
+        if not os.path.exists(filename):
+            return {}
+        try:
+            with open(filename) as fp:
+                cache = json.load(fp)
+            if not isinstance(cache, dict):
+                raise ValueError("expected a JSON object")
+        except (IOError, OSError, ValueError) as exc:
+            if warn and not self.args.quiet:
+                print("WARNING: ignore invalid calibration cache %s: %s"
+                      % (filename, exc))
+            return {}
+        return cache
+
+    def _get_cached_loops(self, key):
+        loops = self._load_calibration_cache().get(key)
+        if not isinstance(loops, six.integer_types) or loops < 1:
+            return None
+        return loops
+
+    def _set_cached_loops(self, key, loops):
+        cache = self._load_calibration_cache(warn=False)
+        cache[key] = loops
+
+        # write into a temporary file and then rename it, to not corrupt
+        # the cache if the process is killed or if multiple processes
+        # update the cache
+        filename = self.args.calibration_cache
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(prefix='.calibration-cache-',
+                                            dir=dirname)
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(cache, fp, sort_keys=True, indent=4)
+                fp.write("\n")
+            replace_file(tmp_filename, filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+
+    def _check_cached_loops(self, suite):
+        # Check if the raw samples of the first worker are close to min_time
+        run = suite.get_benchmarks()[0].get_runs()[-1]
+        raw_sample = statistics.median(run._get_raw_samples())
+        min_time = self.args.min_time
+        return (min_time * (1.0 - CALIBRATION_CACHE_TOLERANCE)
+                <= raw_sample
+                <= 2 * min_time * (1.0 + CALIBRATION_CACHE_TOLERANCE))
+
+    def _run_interleaved(self):
+        # atexit callback of the --interleave mode. Exceptions raised by
+        # atexit callbacks are ignored: exit explicitly with an error.
+        args = self.args
+        try:
+            if args.worker:
+                self._interleave_worker()
+            else:
+                self._interleave_master()
+        except KeyboardInterrupt:
+            what = "Benchmark worker" if args.worker else "Benchmark"
+            print("%s interrupted: exit" % what, file=sys.stderr)
+            sys.stderr.flush()
+            os._exit(1)
+        except BaseException:
+            traceback.print_exc()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(1)
+
+    def _interleave_worker(self):
+        # Run all benchmarks in a random order to not correlate the time of
+        # the run with the benchmark
+        args = self.args
+        tasks = self._interleave_tasks
+        if not args.calibrate:
+            if args.task_loops is not None:
+                task_loops = [int(loops)
+                              for loops in args.task_loops.split(',')]
+                if len(task_loops) != len(tasks):
+                    raise ValueError("--task-loops contains %s values, "
+                                     "but the script has %s benchmarks"
+                                     % (len(task_loops), len(tasks)))
+            else:
+                task_loops = [args.loops] * len(tasks)
+
+        order = list(range(len(tasks)))
+        random.shuffle(order)
+
+        benchmarks = []
+        for task in order:
+            name, sample_func, inner_loops, metadata = tasks[task]
+            if not args.calibrate:
+                args.loops = task_loops[task]
+            bench = self._worker(name, sample_func, inner_loops, metadata,
+                                 display=False)
+            benchmarks.append(bench)
+
+        if args.pipe is not None:
+            # write all benchmarks at once into the pipe
+            suite = perf.BenchmarkSuite(benchmarks)
+            wpipe = self._get_pipe_file()
+            try:
+                suite.dump(wpipe)
+            except IOError as exc:
+                if exc.errno != errno.EPIPE:
+                    raise
+                # ignore broken pipe error
+            wpipe.close()
+            self._pipe_file = None
+        else:
+            for bench in benchmarks:
+                self._display_result(bench, checks=False)
+
+    def _interleave_master(self):
+        # Each worker runs all benchmarks: split the runs of each worker
+        # into one benchmark per task
+        args = self.args
+        verbose = args.verbose
+        quiet = args.quiet
+        names = [task[0] for task in self._interleave_tasks]
+        self._failed_attempts = []
+        self._failed_processes = []
+        self._worker_success = False
+
+        nprocess = args.processes
+        calibrate = not args.loops
+        if calibrate:
+            nprocess += 1
+        else:
+            self._task_loops = [args.loops] * len(names)
+
+        benchmarks = {}
+        for process, suite in self._iter_worker_suites(nprocess, calibrate):
+            if suite is None:
+                # the worker failed, even after retries
+                continue
+
+            worker_names = suite.get_benchmark_names()
+            if sorted(worker_names) != sorted(names):
+                raise ValueError("worker produced the benchmarks %s "
+                                 "instead of %s"
+                                 % (', '.join(worker_names),
+                                    ', '.join(names)))
+
+            for worker_bench in suite:
+                name = worker_bench.get_name()
+                if verbose:
+                    run = worker_bench.get_runs()[-1]
+                    run_index = '%s/%s' % (process, nprocess)
+                    for line in format_run(worker_bench, run_index, run):
+                        print("%s: %s" % (name, line))
+
+                if name in benchmarks:
+                    benchmarks[name].add_runs(worker_bench)
+                else:
+                    benchmarks[name] = worker_bench
+            if not verbose and not quiet:
+                print(".", end='')
+
+            if calibrate:
+                self._task_loops = [benchmarks[name].get_runs()[0]._get_loops()
+                                    for name in names]
+                if verbose:
+                    print("Calibration: use %s loops"
+                          % ', '.join(map(format_number, self._task_loops)))
+            calibrate = False
+            sys.stdout.flush()
+
+        if not quiet:
+            print()
+        self._check_worker_success()
+
+        for task, name in enumerate(names):
+            bench = benchmarks[name]
+            if self._failed_attempts:
+                metadata = {'failed_attempts': len(self._failed_attempts)}
+                if self._failed_processes:
+                    metadata['failed_processes'] = len(self._failed_processes)
+                bench.update_metadata(metadata)
+            # _display_result() uses the task number to append to --output
+            self._worker_task = task
+            self._display_result(bench)
+        self._worker_task = len(names)
+
+    def _master(self, name=None):
+        bench = self._spawn_workers(name=name)
         self._display_result(bench)
         return bench
+
+    def _master_cold_start(self, name):
+        # --cold-start: measure the first call of the benchmark in fresh
+        # worker processes, run in parallel on the allowed CPUs. Each process
+        # computes a single sample of a single loop without warmup. Workers
+        # are always spawned: the --pool workers and the --fork master
+        # already ran the benchmark.
+        args = self.args
+        verbose = args.verbose
+        quiet = args.quiet
+        nprocess = min(args.processes * args.samples,
+                       MAX_COLD_START_PROCESSES)
+        old_values = (args.loops, args.warmups, args.samples, args.jobs,
+                      args.pool, self._job_cpus, self._fork_task)
+
+        if verbose:
+            print()
+            print("Cold start: %s" % format_number(nprocess, 'process',
+                                                   'processes'))
+
+        del self._failed_attempts[:]
+        del self._failed_processes[:]
+        self._worker_success = False
+
+        cold_name = COLD_START_NAME % name
+        cold_metadata = {'name': cold_name, 'cold_start': name}
+        bench = None
+        args.loops = 1
+        args.warmups = 0
+        args.samples = 1
+        args.pool = False
+        self._fork_task = None
+        self._rotate_offset = 0
+        if args.jobs == 1:
+            cpus = self._get_allowed_cpus()
+            if cpus and len(cpus) > 1:
+                args.jobs = len(cpus)
+                self._job_cpus = cpus
+        try:
+            for process, suite in self._iter_worker_suites(nprocess, False):
+                if suite is None:
+                    # the worker failed, even after retries
+                    continue
+                _update_suite_metadata(suite, cold_metadata)
+                worker_bench = suite.get_benchmarks()[0]
+
+                if verbose:
+                    run = worker_bench.get_runs()[-1]
+                    run_index = '%s/%s' % (process, nprocess)
+                    for line in format_run(worker_bench, run_index, run):
+                        print(line)
+                elif not quiet:
+                    print(".", end='')
+                sys.stdout.flush()
+
+                if bench is not None:
+                    bench.add_runs(worker_bench)
+                else:
+                    bench = worker_bench
+        finally:
+            (args.loops, args.warmups, args.samples, args.jobs,
+             args.pool, self._job_cpus, self._fork_task) = old_values
+
+        if not quiet:
+            print()
+        self._check_worker_success()
+
+        if self._failed_attempts:
+            metadata = {'failed_attempts': len(self._failed_attempts)}
+            if self._failed_processes:
+                metadata['failed_processes'] = len(self._failed_processes)
+            bench.update_metadata(metadata)
+
+        # don't suggest to use more loops or samples
+        self._display_result(bench, checks=False, append_output=True)
+        return bench
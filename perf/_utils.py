@@ -5,6 +5,7 @@ import datetime
 import math
 import os
 import platform
+import random
 import sys
 
 import six
@@ -131,6 +132,56 @@ def is_significant(sample1, sample2):
     return (abs(t_score) >= critical_value, t_score)
 
 
+def median_confidence_interval(samples, z=1.96):
+    """Compute a distribution-free confidence interval of the median.
+
+    Use order statistics: the ranks of the bounds are computed using the
+    normal approximation of the binomial distribution. The default z score
+    gives a 95% confidence interval.
+
+    Args:
+        samples: a sequence of numbers.
+        z: z score of the confidence level.
+
+    Returns:
+        (low, high) tuple, or None if there are not enough samples.
+    """
+    nsample = len(samples)
+    half_width = z * math.sqrt(nsample) / 2.0
+    # 1-based ranks
+    low = int(math.floor(nsample / 2.0 - half_width))
+    high = int(math.ceil(1 + nsample / 2.0 + half_width))
+    if low < 1 or high > nsample:
+        return None
+
+    samples = sorted(samples)
+    return (samples[low - 1], samples[high - 1])
+
+
+def robust_zscore(value, values, min_mad=0.0):
+    """Compute the modified z-score of value compared to values.
+
+    Use the median and the median absolute deviation (MAD), which are not
+    impacted by outliers, rather than the mean and the standard deviation.
+
+    Args:
+        value: a number.
+        values: a non-empty sequence of numbers.
+        min_mad: lower bound of the MAD.
+
+    Returns:
+        float, or None if the MAD is zero.
+    """
+    median = statistics.median(values)
+    mad = statistics.median([abs(x - median) for x in values])
+    mad = max(mad, min_mad)
+    if not mad:
+        return None
+    # 0.6745 is the 0.75 quantile of the standard normal distribution:
+    # the score is comparable to a z-score for normally distributed values
+    return 0.6745 * (value - median) / mad
+
+
 def parse_run_list(run_list):
     run_list = run_list.strip()
 
@@ -166,6 +217,17 @@ def open_text(path, write=False):
         return open(path, mode)
 
 
+def replace_file(src, dst):
+    # Atomically replace dst with src
+    if six.PY3:
+        os.replace(src, dst)
+    else:
+        if MS_WINDOWS and os.path.exists(dst):
+            # os.rename() fails if dst exists on Windows
+            os.unlink(dst)
+        os.rename(src, dst)
+
+
 def read_first_line(path, error=False):
     try:
         fp = open_text(path)
@@ -326,7 +388,15 @@ def abs_executable(python):
     return os.path.normpath(abs_python)
 
 
-def create_environ(inherit_environ, locale):
+# Environment variable padding the environment of worker processes,
+# see the --randomize-env option of Runner
+ENV_PADDING_VAR = 'PERF_ENV_PADDING'
+MAX_ENV_PADDING = 4096
+# Maximum value of PYTHONHASHSEED
+MAX_HASH_SEED = 2 ** 32 - 1
+
+
+def create_environ(inherit_environ, locale, randomize=False):
     env = {}
 
     copy_env = ["PATH", "HOME", "TEMP", "COMSPEC", "SystemRoot"]
@@ -341,6 +411,13 @@ def create_environ(inherit_environ, locale):
     for name in copy_env:
         if name in os.environ:
             env[name] = os.environ[name]
+
+    if randomize:
+        # Use a different hash function and shift the memory layout: the
+        # environment is copied at the top of the stack. PYTHONHASHSEED=0
+        # disables hash randomization.
+        env['PYTHONHASHSEED'] = str(random.randint(1, MAX_HASH_SEED))
+        env[ENV_PADDING_VAR] = 'x' * random.randint(0, MAX_ENV_PADDING)
     return env
 
 
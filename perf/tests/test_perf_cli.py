@@ -2,8 +2,12 @@ import os
 import sys
 import textwrap
 
+import six
+
 import perf
 from perf import tests
+from perf._rerun import Rerun
+from perf.tests import mock
 from perf.tests import unittest
 
 
@@ -227,6 +231,27 @@ class TestPerfCLI(BaseTestCase, unittest.TestCase):
         """)
         self.check_command(expected, 'show', TELCO)
 
+    def test_show_scaling(self):
+        benchmarks = []
+        for nthread, sample in ((1, 1.0), (2, 0.5), (4, 0.4)):
+            metadata = {'name': 'bench (threads=%s)' % nthread,
+                        'threads': nthread}
+            benchmarks.append(self.create_bench((sample,) * 3,
+                                                metadata=metadata))
+        suite = perf.BenchmarkSuite(benchmarks)
+
+        with tests.temporary_file() as tmp_name:
+            suite.dump(tmp_name)
+            stdout = self.run_command('show', '-q', tmp_name)
+
+        expected = textwrap.dedent('''
+            Scaling of bench:
+            - 1 thread: 1.00 sec per call, 1.00x throughput, efficiency 100%
+            - 2 threads: 500 ms per call, 2.00x throughput, efficiency 100%
+            - 4 threads: 400 ms per call, 2.50x throughput, efficiency 62%
+        ''').strip()
+        self.assertIn(expected, stdout)
+
     def test_stats(self):
         expected = ("""
             Total duration: 29.2 sec
@@ -248,6 +273,25 @@ class TestPerfCLI(BaseTestCase, unittest.TestCase):
         """)
         self.check_command(expected, 'stats', TELCO)
 
+    def test_stats_cpu(self):
+        runs = []
+        for cpu, sample in ((0, 1.0), (1, 1.1), (0, 1.0), (1, 1.1), (1, 1.1)):
+            run = perf.Run([sample], metadata={'name': 'bench', 'cpu': cpu},
+                           collect_metadata=False)
+            runs.append(run)
+        bench = perf.Benchmark(runs)
+
+        with tests.temporary_file() as tmp_name:
+            bench.dump(tmp_name)
+            stdout = self.run_command('stats', tmp_name)
+
+        expected = textwrap.dedent('''
+            Median per CPU:
+            - CPU 0: 1.00 sec (-9.1%, 2 samples)
+            - CPU 1: 1.10 sec (+0.0%, 3 samples)
+        ''').strip()
+        self.assertIn(expected, stdout)
+
     def test_dump_raw(self):
         expected = """
             Run 1: calibrate
@@ -327,6 +371,130 @@ class TestPerfCLI(BaseTestCase, unittest.TestCase):
         self.assertRegex(stdout,
                          r'^Metadata:\n(- [^:]+: .*\n)+$')
 
+    def test_command(self):
+        # allocate 100 MB: more than the worker process
+        code = "data = b'x' * (100 * 1024 * 1024)"
+        with tests.temporary_directory() as tmpdir:
+            filename = os.path.join(tmpdir, 'command.json')
+            self.run_command('command', '--inherit-environ=PYTHONPATH',
+                             '-p1', '-n2', '-w0', '-l1', '-q',
+                             '-o', filename, '--name', 'startup',
+                             '--', sys.executable, '-c', code)
+            bench = perf.Benchmark.load(filename)
+
+        self.assertEqual(bench.get_name(), 'startup')
+        self.assertEqual(bench.get_nsample(), 2)
+        metadata = bench.get_metadata()
+        self.assertEqual(metadata['command'],
+                         '%s -c %s' % (sys.executable, code))
+        if hasattr(os, 'wait4'):
+            run_metadata = bench.get_runs()[0].get_metadata()
+            self.assertGreaterEqual(run_metadata['command_max_rss'],
+                                    100 * 1024 * 1024)
+            self.assertIn('command_user_time', run_metadata)
+
+    def test_command_max_rss_inherited(self):
+        from perf._command import CommandSampleFunc
+
+        rusage = mock.Mock(ru_utime=1.0, ru_stime=0.5, ru_maxrss=1000)
+        metadata = {}
+        sample_func = CommandSampleFunc(['true'], metadata)
+        # the command didn't use more memory than the worker process
+        sample_func._add_rusage(rusage, 2000 * 1024)
+        self.assertNotIn('command_max_rss', metadata)
+        self.assertEqual(metadata['command_user_time'], 1.0)
+
+    def test_rerun(self):
+        script = textwrap.dedent('''
+            import perf
+
+            def func():
+                pass
+
+            runner = perf.Runner()
+            runner.bench_func('unstable', func)
+            runner.bench_func('stable', func)
+        ''')
+        with tests.temporary_directory() as tmpdir:
+            script_name = os.path.join(tmpdir, 'script.py')
+            with open(script_name, 'w') as fp:
+                fp.write(script)
+            filename = os.path.join(tmpdir, 'bench.json')
+            proc = tests.get_output([sys.executable, script_name,
+                                     '--inherit-environ=PYTHONPATH',
+                                     '-p2', '-n2', '-w0', '-l1000', '-q',
+                                     '-o', filename])
+            self.assertEqual(proc.returncode, 0, proc.stdout + proc.stderr)
+
+            # make the first benchmark unstable and the second stable
+            suite = perf.BenchmarkSuite.load(filename)
+            for name, samples in (('unstable', (1.0, 3.0)),
+                                  ('stable', (1.0, 1.0))):
+                bench = suite.get_benchmark(name)
+                runs = [run._replace(samples=[sample, sample])
+                        for run, sample in zip(bench.get_runs(), samples)]
+                bench._replace_runs(runs)
+            suite.dump(filename, replace=True)
+
+            stdout = self.run_command('rerun', '--budget', '1s', '-p1',
+                                      filename, script_name,
+                                      '--inherit-environ=PYTHONPATH')
+            suite = perf.BenchmarkSuite.load(filename)
+
+        self.assertIn('unstable: add 1 run', stdout)
+        # only the unstable benchmark is rerun
+        self.assertGreater(suite.get_benchmark('unstable').get_nrun(), 2)
+        self.assertEqual(suite.get_benchmark('stable').get_nrun(), 2)
+
+    def test_rerun_skip_and_failure(self):
+        cold = self.create_bench((1.0, 3.0),
+                                 metadata={'name': 'bench (cold start)',
+                                           'cold_start': 'bench'})
+        failing = self.create_bench((1.0, 3.0), metadata={'name': 'failing'})
+        unstable = self.create_bench((1.0, 4.0), metadata={'name': 'bench'})
+        suite = perf.BenchmarkSuite([cold, failing, unstable])
+
+        def run_script(bench, nprocess):
+            if bench.get_name() == 'failing':
+                raise RuntimeError("script.py failed with exit code 1")
+            return self.create_bench((2.0,) * nprocess,
+                                     metadata={'name': bench.get_name()})
+
+        with tests.temporary_file() as tmp_name:
+            suite.dump(tmp_name)
+            args = mock.Mock(filename=tmp_name, output=None, budget=60.0,
+                             processes=5)
+            rerun = Rerun(args)
+            # benchmark names loaded from JSON are unicode on Python 2
+            stdout = six.StringIO()
+            with mock.patch.object(rerun, '_run_script', run_script):
+                with mock.patch('sys.stdout', stdout):
+                    with self.assertRaises(SystemExit) as cm:
+                        rerun.main()
+            suite = perf.BenchmarkSuite.load(tmp_name)
+
+        self.assertEqual(cm.exception.code, 1)
+        stdout = stdout.getvalue()
+        self.assertIn('bench (cold start): skip cold start benchmark\n',
+                      stdout)
+        self.assertIn('ERROR: failed to rerun failing: script.py failed '
+                      'with exit code 1\n', stdout)
+        self.assertIn('Other benchmarks are stable\n', stdout)
+        self.assertIn('ERROR: failed to rerun 1 benchmark: failing\n',
+                      stdout)
+        # the other benchmark is still rerun
+        self.assertGreater(suite.get_benchmark('bench').get_nrun(), 2)
+        self.assertEqual(suite.get_benchmark('bench (cold start)').get_nrun(),
+                         2)
+
+    def test_rerun_processes(self):
+        cmd = [sys.executable, '-m', 'perf', 'rerun', '--budget', '1s',
+               '-p0', 'bench.json', 'script.py']
+        proc = tests.get_output(cmd)
+        self.assertEqual(proc.returncode, 2)
+        self.assertIn("argument -p/--processes: invalid strictly_positive "
+                      "value: '0'", proc.stderr)
+
     def test_slowest(self):
         stdout = self.run_command('slowest', TELCO)
         self.assertEqual(stdout.rstrip(),
@@ -1,13 +1,19 @@
 import collections
+import gc
+import itertools
+import json
 import os.path
+import sys
 import tempfile
 import textwrap
+import threading
 
 import six
 
 import perf
 from perf import tests
-from perf._utils import pipe_cloexec
+from perf._bench import _load_suite_from_pipe
+from perf._utils import pipe_cloexec, ENV_PADDING_VAR
 from perf.tests import mock
 from perf.tests import unittest
 
@@ -23,6 +29,36 @@ def check_args(loops, a, b):
 
 Result = collections.namedtuple('Result', 'runner bench stdout')
 
+# Script of the end-to-end tests spawning real worker processes
+BENCH_SCRIPT = '''
+import os
+import perf
+
+def func():
+    pass
+
+runner = perf.Runner()
+runner.metadata['worker_pid'] = os.getpid()
+runner.bench_func('bench1', func)
+runner.bench_func('bench2', func)
+'''
+
+# Number of loops computed by the calibration of fake workers
+FAKE_CALIBRATED_LOOPS = 8
+
+
+class CountHook(object):
+    # Hook of test_hook()
+    def before_run(self, metadata):
+        metadata['hook_runs'] = 1
+
+    def before_sample(self):
+        self.start = 1
+
+    def after_sample(self):
+        # 'loops' is stored as 'hook_loops'
+        return {'samples': self.start, 'loops': 2}
+
 
 class TestRunner(unittest.TestCase):
     def exec_runner(self, *args, **kwargs):
@@ -65,6 +101,92 @@ class TestRunner(unittest.TestCase):
         self.assertRegex(result.stdout,
                          r'^bench: Median \+- std dev: 1\.00 sec \+- 0\.00 sec\n$')
 
+    def test_gc_disable(self):
+        gc_enabled = []
+
+        def sample_func(loops):
+            gc_enabled.append(gc.isenabled())
+            return 1.0
+
+        result = self.exec_runner('--worker', '-l1', '-w1', '-n2',
+                                  '--gc=disable', sample_func=sample_func)
+        self.assertEqual(gc_enabled, [False, False, False])
+        self.assertTrue(gc.isenabled())
+
+        metadata = result.bench.get_metadata()
+        self.assertEqual(metadata['gc_policy'], 'disable')
+        if hasattr(gc, 'get_stats'):
+            self.assertEqual(metadata['gc_collections_gen0'], 0)
+
+    def test_bench_func_inputs(self):
+        calls = []
+
+        def func(x, y):
+            calls.append((x, y))
+
+        def inputs():
+            return [(1, 2), (3, 4)]
+
+        runner = perf.Runner()
+        runner.parse_args(['--worker', '-l3', '-w0', '-n2'])
+        with tests.capture_stdout():
+            bench = runner.bench_func('bench', func, inputs=inputs)
+
+        # the pool of inputs is cycled to get one input per loop iteration
+        self.assertEqual(calls, [(1, 2), (3, 4), (1, 2)] * 2)
+        self.assertEqual(bench.get_nsample(), 2)
+
+        with self.assertRaises(ValueError):
+            runner.bench_func('bench', func, 1, 2, inputs=inputs)
+
+    def test_bench_func_inputs_pool_size(self):
+        calls = []
+
+        def func(x):
+            calls.append(x)
+
+        def inputs():
+            return [(x,) for x in range(10)]
+
+        runner = perf.Runner()
+        runner.parse_args(['--worker', '-l5', '-w0', '-n1'])
+        with mock.patch('perf._runner.INPUT_POOL_SIZE', 2):
+            with tests.capture_stdout():
+                runner.bench_func('bench', func, inputs=inputs)
+
+        # the pool is limited to 2 argument tuples
+        self.assertEqual(calls, [0, 1, 0, 1, 0])
+
+        # input_pool_size overrides the default pool size
+        del calls[:]
+        with tests.capture_stdout():
+            runner.bench_func('bench2', func, inputs=inputs,
+                              input_pool_size=3)
+        self.assertEqual(calls, [0, 1, 2, 0, 1])
+
+        for size in (0, 1.5):
+            with self.assertRaises(ValueError):
+                runner.bench_func('bench', func, inputs=inputs,
+                                  input_pool_size=size)
+        with self.assertRaises(ValueError):
+            runner.bench_func('bench', func, input_pool_size=3)
+
+    def test_bench_func_inputs_overhead(self):
+        def func(x):
+            pass
+
+        def inputs():
+            return [(1,)]
+
+        runner = perf.Runner()
+        sample_func = runner._inputs_sample_func(func, inputs)
+
+        # the overhead of the pool iteration (5 seconds) is longer than the
+        # sample (2 seconds): the sample must not be zero
+        timer = mock.Mock(side_effect=[0.0, 2.0, 10.0, 15.0])
+        with mock.patch('perf.perf_counter', timer):
+            self.assertEqual(sample_func(1), 2.0)
+
     def test_debug_single_sample(self):
         result = self.exec_runner('--debug-single-sample', '--worker')
         self.assertEqual(result.bench.get_nsample(), 1)
@@ -88,6 +210,40 @@ class TestRunner(unittest.TestCase):
         self.assertEqual(bench_json,
                          tests.benchmark_as_json(result.bench))
 
+    def test_pipe_stream(self):
+        rpipe, wpipe = pipe_cloexec()
+        if six.PY3:
+            rfile = open(rpipe, "r", encoding="utf8")
+        else:
+            rfile = os.fdopen(rpipe, "r")
+
+        with rfile:
+            # need to duplicate because the worker closes the pipe FD
+            wpipe2 = os.dup(wpipe)
+            try:
+                result = self.exec_runner('--pipe', str(wpipe2), '--worker',
+                                          '--stream', '-w1', '-n2', '-l1')
+            finally:
+                os.close(wpipe)
+
+            lines = rfile.readlines()
+
+        events = [json.loads(line) for line in lines[:-1]]
+        # the start event carries the metadata of the run
+        start = events.pop(0)
+        self.assertEqual(start['event'], 'start')
+        self.assertEqual(start['metadata']['name'], 'bench')
+        self.assertIn('python_version', start['metadata'])
+        self.assertEqual(events,
+                         [{'event': 'warmup', 'index': 1, 'loops': 1,
+                           'raw_sample': 1.0},
+                          {'event': 'sample', 'index': 1, 'loops': 1,
+                           'raw_sample': 1.0},
+                          {'event': 'sample', 'index': 2, 'loops': 1,
+                           'raw_sample': 1.0}])
+        self.assertEqual(lines[-1],
+                         tests.benchmark_as_json(result.bench))
+
     def test_json_exists(self):
         with tempfile.NamedTemporaryFile('wb+') as tmp:
 
@@ -128,29 +284,35 @@ class TestRunner(unittest.TestCase):
         for run in result.bench.get_runs():
             self.assertEqual(run.get_total_loops(), 2 ** 17)
 
+        # the number of loops is extrapolated from the raw samples
         expected = textwrap.dedent('''
             Calibration 1: 1.00 us (1 loop: 1.00 us)
-            Calibration 2: 1.00 us (2 loops: 2.00 us)
-            Calibration 3: 1.00 us (4 loops: 4.00 us)
-            Calibration 4: 1.00 us (8 loops: 8.00 us)
-            Calibration 5: 1.00 us (16 loops: 16.0 us)
-            Calibration 6: 1.00 us (32 loops: 32.0 us)
-            Calibration 7: 1.00 us (64 loops: 64.0 us)
-            Calibration 8: 1.00 us (128 loops: 128 us)
-            Calibration 9: 1.00 us (256 loops: 256 us)
-            Calibration 10: 1.00 us (512 loops: 512 us)
-            Calibration 11: 1.00 us (1024 loops: 1.02 ms)
-            Calibration 12: 1.00 us (2048 loops: 2.05 ms)
-            Calibration 13: 1.00 us (4096 loops: 4.10 ms)
-            Calibration 14: 1.00 us (8192 loops: 8.19 ms)
-            Calibration 15: 1.00 us (2^14 loops: 16.4 ms)
-            Calibration 16: 1.00 us (2^15 loops: 32.8 ms)
-            Calibration 17: 1.00 us (2^16 loops: 65.5 ms)
-            Calibration 18: 1.00 us (2^17 loops: 131 ms)
-
+            Calibration 2: 1.00 us (1024 loops: 1.02 ms)
+            Calibration 3: 1.00 us (2^17 loops: 131 ms)
+            Calibration: use 2^17 loops
         ''').strip()
         self.assertIn(expected, result.stdout)
 
+        run = result.bench.get_runs()[0]
+        self.assertEqual(run.get_metadata()['calibration_steps'], 3)
+
+    def test_loops_calibration_non_linear(self):
+        def sample_func(loops):
+            # the code becomes 1000x faster after 1024 iterations
+            if loops <= 1024:
+                return loops * 1e-6
+            else:
+                return loops * 1e-9
+
+        result = self.exec_runner('--worker', sample_func=sample_func)
+
+        # the extrapolated number of loops (2^17) is not enough:
+        # fall back to doubling the number of loops
+        for run in result.bench.get_runs():
+            self.assertEqual(run.get_total_loops(), 2 ** 27)
+        run = result.bench.get_runs()[0]
+        self.assertEqual(run.get_metadata()['calibration_steps'], 13)
+
     def test_loops_calibration_min_time(self):
         def sample_func(loops):
             # number of iterations => number of microseconds
@@ -161,6 +323,52 @@ class TestRunner(unittest.TestCase):
         for run in result.bench.get_runs():
             self.assertEqual(run.get_total_loops(), 2 ** 10)
 
+    def test_loops_calibration_max_time(self):
+        def sample_func(loops):
+            # 60 ms per loop iteration
+            return loops * 0.060
+
+        result = self.exec_runner('--worker', '-v', '--min-time=0.1',
+                                  '--max-time=0.11', sample_func=sample_func)
+
+        # 2 loops would exceed max_time
+        for run in result.bench.get_runs():
+            self.assertEqual(run.get_total_loops(), 1)
+        self.assertIn('Calibration: stop, doubling the number of loops '
+                      'would exceed max_time', result.stdout)
+
+    def test_max_time_default(self):
+        # --min-time larger than the default max_time without --max-time
+        runner = perf.Runner()
+        args = runner.parse_args(['--min-time=2'])
+        self.assertEqual(args.max_time, 2.0)
+
+        runner = perf.Runner(min_time=2)
+        args = runner.parse_args([])
+        self.assertEqual(args.max_time, 2.0)
+
+        runner = perf.Runner()
+        args = runner.parse_args(['--min-time=0.5'])
+        self.assertEqual(args.max_time, 1.0)
+        # workers get the max_time of the master
+        cmd = runner._worker_cmd(False, 3)
+        self.assertEqual(cmd[cmd.index('--max-time') + 1], '1.0')
+
+        runner = perf.Runner()
+        with tests.capture_stdout() as stdout:
+            with self.assertRaises(SystemExit):
+                runner.parse_args(['--min-time=2', '--max-time=1'])
+        self.assertIn('ERROR: --max-time must be greater than or equal to '
+                      '--min-time', stdout.getvalue())
+
+    def test_loops_calibration_max_time_warning(self):
+        def sample_func(loops):
+            return loops * 2.0
+
+        result = self.exec_runner('--worker', sample_func=sample_func)
+        self.assertIn('WARNING: calibration raw sample (2.00 sec) is longer '
+                      'than max_time (1.00 sec)', result.stdout)
+
     def test_json_file(self):
         with tests.temporary_directory() as tmpdir:
             filename = os.path.join(tmpdir, 'test.json')
@@ -231,22 +439,94 @@ class TestRunner(unittest.TestCase):
 
         run = runs[0]
         self.assertEqual(run.warmups,
-                         # first calibration samples are zero
+                         # first calibration sample is zero: the number of
+                         # loops cannot be extrapolated
                          ((1, 0.0),
-                          (2, 0.0),
-                          (4, 0.0),
-                          (8, 0.0),
 
                           # first non-zero calibration sample
-                          (16, 3.0),
+                          (1024, 3.0),
 
-                          # warmup 1, JIT triggered, 3.0 => 0.5 for loops=128
-                          (16, 0.5),
-                          # warmup 1, new try with loops x 2
-                          (32, 1.0),
+                          # warmup 1, JIT triggered, 3.0 => 0.5 for loops=1024
+                          (1024, 0.5),
+                          # warmup 1, new try with extrapolated loops
+                          (2048, 1.0),
 
                           # warmup 2
-                          (32, 1.0)))
+                          (2048, 1.0)))
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'need Python 3.5 or newer')
+    def test_bench_async_func(self):
+        import asyncio
+
+        class EventLoop(asyncio.SelectorEventLoop):
+            pass
+
+        calls = []
+
+        # async def is a syntax error on Python 2: compile it at runtime
+        namespace = {'calls': calls}
+        exec(textwrap.dedent('''
+            async def coro_func(arg):
+                calls.append(arg)
+        '''), namespace)
+        coro_func = namespace['coro_func']
+
+        runner = perf.Runner()
+        # disable CPU affinity to not pollute stdout
+        runner._cpu_affinity = lambda: None
+        runner.parse_args(['--worker', '-l3', '-w0', '-n2'])
+
+        with tests.capture_stdout():
+            bench = runner.bench_async_func('bench', coro_func, 'arg',
+                                            loop_factory=EventLoop)
+
+        self.assertEqual(calls, ['arg'] * 6)
+        self.assertEqual(bench.get_nsample(), 2)
+        self.assertEqual(bench.get_metadata()['async_loop'],
+                         '%s.EventLoop' % __name__)
+
+    def test_bench_threaded_func(self):
+        lock = threading.Lock()
+        calls = []
+
+        def func(arg):
+            with lock:
+                calls.append(arg)
+
+        runner = perf.Runner()
+        # disable CPU affinity to not pollute stdout
+        runner._cpu_affinity = lambda: None
+        runner.parse_args(['--worker', '-l3', '-w0', '-n2'])
+
+        with tests.capture_stdout():
+            benchmarks = runner.bench_threaded_func('bench', func, 'arg',
+                                                    threads=2)
+
+        # 1 thread: 2 samples x 3 loops, 2 threads: 2 x 2 samples x 3 loops
+        self.assertEqual(len(calls), 6 + 12)
+        self.assertEqual([bench.get_name() for bench in benchmarks],
+                         ['bench (threads=1)', 'bench (threads=2)'])
+        for nthread, bench in enumerate(benchmarks, 1):
+            metadata = bench.get_metadata()
+            self.assertEqual(metadata['threads'], nthread)
+            self.assertEqual(metadata['inner_loops'], nthread)
+
+    def test_aggregate_scaling_runs(self):
+        runner = perf.Runner()
+        runs = [perf.Run([1.0, 2.0, 4.0],
+                         metadata={'name': 'bench', 'cpu': 2, 'duration': 3.0},
+                         collect_metadata=False),
+                perf.Run([1.0, 2.0],
+                         metadata={'name': 'bench', 'cpu': 3, 'duration': 5.0},
+                         collect_metadata=False)]
+
+        run = runner._aggregate_scaling_runs(runs, [2, 3])
+        # time per call of the throughput of the two processes
+        self.assertEqual(run.samples, (0.5, 1.0))
+        metadata = run.get_metadata()
+        self.assertNotIn('cpu', metadata)
+        self.assertEqual(metadata['duration'], 5.0)
+        self.assertEqual(metadata['parallel_cpus'], '2-3')
 
     def test_loops_power(self):
         runner = perf.Runner()
@@ -304,6 +584,725 @@ class TestRunner(unittest.TestCase):
         self.assertRegex(result.stdout,
                          r'^Median \+- std dev: 1\.00 sec \+- 0\.00 sec\n$')
 
+    def test_jobs(self):
+        runner = perf.Runner()
+        with mock.patch('perf._runner.get_isolated_cpus', return_value=None):
+            with mock.patch('perf._runner.get_logical_cpu_count',
+                            return_value=2):
+                with mock.patch('perf._runner.select_sibling_free_cpus',
+                                return_value=[0, 1]):
+                    runner.parse_args(['--jobs=2', '-p5', '-l1', '-q'])
+        self.assertEqual(runner._job_cpus, [0, 1])
+
+        lock = threading.Lock()
+
+        def spawn_worker(calibrate=False, cpu=None):
+            with lock:
+                spawn_worker.sample += 1.0
+                sample = spawn_worker.sample
+            run = perf.Run([sample], metadata={'name': 'bench', 'cpu': cpu},
+                           collect_metadata=False)
+            return perf.BenchmarkSuite([perf.Benchmark([run])])
+        spawn_worker.sample = 0.0
+
+        with mock.patch.object(runner, '_spawn_worker', spawn_worker):
+            bench = runner._spawn_workers()
+
+        self.assertEqual(sorted(bench.get_samples()),
+                         [1.0, 2.0, 3.0, 4.0, 5.0])
+        cpus = set(run.get_metadata()['cpu'] for run in bench.get_runs())
+        self.assertLessEqual(cpus, {0, 1})
+
+    def test_jobs_cmd(self):
+        runner = perf.Runner()
+        runner.parse_args(['--affinity=0-3'])
+        cmd = runner._worker_cmd(False, 3, affinity='2')
+        self.assertIn('--affinity=2', cmd)
+        self.assertNotIn('--affinity=0-3', cmd)
+
+    def test_rotate_cpus(self):
+        runner = perf.Runner()
+        runner.parse_args(['--rotate-cpus', '--affinity=0-2',
+                           '-p5', '-l1', '-q'])
+        self.assertEqual(runner._rotate_cpus, [0, 1, 2])
+
+        def spawn_worker(calibrate=False, cpu=None):
+            run = perf.Run([1.0], metadata={'name': 'bench', 'cpu': cpu},
+                           collect_metadata=False)
+            return perf.BenchmarkSuite([perf.Benchmark([run])])
+
+        with mock.patch.object(runner, '_spawn_worker', spawn_worker):
+            bench = runner._spawn_workers()
+
+        cpus = [run.get_metadata()['cpu'] for run in bench.get_runs()]
+        self.assertEqual(cpus, [0, 1, 2, 0, 1])
+
+    def test_rotate_cpus_calibration(self):
+        runner = perf.Runner()
+        runner.parse_args(['--rotate-cpus', '--affinity=0-2', '-p3', '-q'])
+
+        def spawn_worker(calibrate=False, cpu=None):
+            metadata = {'name': 'bench', 'loops': 4}
+            if cpu is not None:
+                metadata['cpu'] = cpu
+            if calibrate:
+                run = perf.Run([], warmups=[(4, 1.0)], metadata=metadata,
+                               collect_metadata=False)
+            else:
+                run = perf.Run([1.0], metadata=metadata,
+                               collect_metadata=False)
+            return perf.BenchmarkSuite([perf.Benchmark([run])])
+
+        with mock.patch.object(runner, '_spawn_worker', spawn_worker):
+            bench = runner._spawn_workers()
+
+        # the rotation starts at the first worker computing samples
+        runs = bench.get_runs()
+        self.assertTrue(runs[0]._is_calibration())
+        self.assertIsNone(runs[0].get_metadata().get('cpu'))
+        cpus = [run.get_metadata()['cpu'] for run in runs[1:]]
+        self.assertEqual(cpus, [0, 1, 2])
+
+    def run_target_ci(self, sample_func):
+        runner = perf.Runner()
+        runner.parse_args(['--target-ci=5%', '-p5', '-n3', '-l1', '-q'])
+        self.assertEqual(runner.args.max_processes, 10)
+
+        def spawn_worker(calibrate=False, cpu=None):
+            samples = [sample_func() for _ in range(3)]
+            run = perf.Run(samples, metadata={'name': 'bench'},
+                           collect_metadata=False)
+            return perf.BenchmarkSuite([perf.Benchmark([run])])
+
+        with mock.patch.object(runner, '_spawn_worker', spawn_worker):
+            return runner._spawn_workers()
+
+    def test_target_ci(self):
+        # stable benchmark: stop as soon as there are enough samples
+        bench = self.run_target_ci(lambda: 1.0)
+        self.assertEqual(bench.get_nrun(), 3)
+        metadata = bench.get_metadata()
+        self.assertEqual(metadata['stop_reason'], 'target_ci')
+        self.assertEqual(metadata['median_ci'], 0.0)
+
+    def test_target_ci_max_processes(self):
+        # unstable benchmark
+        values = iter(itertools.cycle((1.0, 2.0, 3.0)))
+        bench = self.run_target_ci(lambda: next(values))
+        self.assertEqual(bench.get_nrun(), 10)
+        metadata = bench.get_metadata()
+        self.assertEqual(metadata['stop_reason'], 'max_processes')
+        self.assertEqual(metadata['median_ci'], 1.0)
+
+    def run_script(self, *args):
+        # Run BENCH_SCRIPT in a subprocess, return the BenchmarkSuite
+        with tests.temporary_directory() as tmpdir:
+            filename = os.path.join(tmpdir, 'script.py')
+            with open(filename, 'w') as fp:
+                fp.write(BENCH_SCRIPT)
+            output = os.path.join(tmpdir, 'result.json')
+
+            cmd = [sys.executable, filename, '--inherit-environ=PYTHONPATH',
+                   '-q', '-o', output]
+            cmd.extend(args)
+            proc = tests.get_output(cmd)
+            self.assertEqual(proc.returncode, 0, proc.stdout + proc.stderr)
+
+            return perf.BenchmarkSuite.load(output)
+
+    def run_master(self, *args, **kwargs):
+        # Run the master in the current process: spawned workers and --pool
+        # tasks are replaced with fake workers building their run from the
+        # runner arguments. Each worker advances the monotonic clock by 100
+        # ms. sample_func(process) returns the samples of the process-th
+        # worker (default: MIN_TIME / FAKE_CALIBRATED_LOOPS), worker
+        # processes listed in failures fail. Return the BenchmarkSuite and
+        # the list of (kind, calibrate) of workers.
+        names = kwargs.pop('names', ('bench',))
+        sample_func = kwargs.pop('sample_func', None)
+        failures = kwargs.pop('failures', ())
+
+        runner = perf.Runner()
+        workers = []
+        clock = [0.0]
+
+        def run_worker(kind, calibrate=False, cpu=None):
+            workers.append((kind, calibrate))
+            clock[0] += 0.1
+            if len(workers) in failures:
+                raise RuntimeError("worker failed with exit code 1")
+
+            args = runner.args
+            metadata = {'name': names[runner._worker_task]}
+            if cpu is not None:
+                metadata['cpu'] = cpu
+            if calibrate:
+                metadata['loops'] = FAKE_CALIBRATED_LOOPS
+                run = perf.Run([], warmups=[(FAKE_CALIBRATED_LOOPS,
+                                             args.min_time)],
+                               metadata=metadata, collect_metadata=False)
+            else:
+                metadata['loops'] = args.loops
+                if sample_func is not None:
+                    sample = sample_func(len(workers))
+                else:
+                    sample = args.min_time / FAKE_CALIBRATED_LOOPS
+                warmups = [(args.loops, sample * args.loops)] * args.warmups
+                run = perf.Run([sample] * args.samples, warmups=warmups,
+                               metadata=metadata, collect_metadata=False)
+            return perf.BenchmarkSuite([perf.Benchmark([run])])
+
+        def spawn_worker(calibrate=False, cpu=None):
+            return run_worker('spawn', calibrate, cpu)
+
+        def run_pool_task(index):
+            return run_worker('pool')
+
+        with tests.temporary_directory() as tmpdir:
+            output = os.path.join(tmpdir, 'result.json')
+            runner.parse_args(['-q', '-o', output] + list(args))
+            with mock.patch.object(runner, '_spawn_worker', spawn_worker):
+                with mock.patch.object(runner, '_run_pool_task',
+                                       run_pool_task):
+                    with mock.patch.object(runner, '_count_tasks',
+                                           return_value=len(names)):
+                        with mock.patch('perf.monotonic_clock',
+                                        lambda: clock[0]):
+                            with tests.capture_stdout():
+                                for name in names:
+                                    runner.bench_func(name, None)
+            suite = perf.BenchmarkSuite.load(output)
+        return suite, workers
+
+    def test_bench_scaling_func(self):
+        # worker process of the 2 processes benchmark
+        runner = perf.Runner()
+        runner._cpu_affinity = lambda: None
+        runner.parse_args(['--worker', '--worker-task=1',
+                           '-n2', '-w0', '-l1'])
+
+        timer = mock.Mock(side_effect=itertools.count())
+        with mock.patch('perf.perf_counter', timer):
+            with tests.capture_stdout():
+                benchmarks = runner.bench_scaling_func('bench', lambda: None,
+                                                       processes=[1, 2])
+
+        self.assertEqual([bench.get_name() for bench in benchmarks],
+                         ['bench (processes=2)'])
+        metadata = benchmarks[0].get_metadata()
+        self.assertEqual(metadata['parallel_processes'], 2)
+
+    def test_max_retries(self):
+        suite, workers = self.run_master('-p3', '-n2', '-w0', '-l1',
+                                         '--max-retries=1', failures=(2,))
+
+        bench = suite.get_benchmark('bench')
+        self.assertEqual(bench.get_nrun(), 3)
+        self.assertEqual(bench.get_metadata()['failed_attempts'], 1)
+        self.assertNotIn('failed_processes', bench.get_metadata())
+
+    def test_worker_failure(self):
+        # without retries, the benchmark fails on the first worker failure
+        with self.assertRaises(RuntimeError) as cm:
+            self.run_master('-p3', '-n2', '-w0', '-l1', failures=(2,))
+        self.assertIn('failed with exit code 1', str(cm.exception))
+
+    def test_worker_failure_partial_bench(self):
+        # the first worker and its retry fail, but the following workers
+        # succeed
+        suite, workers = self.run_master('-p3', '-n2', '-w0', '-l1',
+                                         '--max-retries=1', failures=(1, 2))
+
+        # the benchmark is returned without the run of the failed worker
+        bench = suite.get_benchmark('bench')
+        self.assertEqual(bench.get_nrun(), 2)
+        metadata = bench.get_metadata()
+        self.assertEqual(metadata['failed_attempts'], 2)
+        self.assertEqual(metadata['failed_processes'], 1)
+
+    def test_worker_timeout(self):
+        runner = perf.Runner()
+        runner.parse_args(['--worker-timeout=5'])
+
+        # the worker writes nothing
+        reader = mock.Mock()
+        reader.readline.return_value = None
+        clock = mock.Mock(side_effect=[100.0, 100.0, 105.0])
+        with mock.patch('perf.monotonic_clock', clock):
+            with self.assertRaises(RuntimeError) as cm:
+                runner._read_stream(reader)
+        self.assertEqual(str(cm.exception), 'worker timed out after 5.00 sec')
+        reader.readline.assert_called_once_with(5.0)
+
+    def test_calibration_cache(self):
+        def is_calibrated(suite):
+            runs = suite.get_benchmark('bench').get_runs()
+            return any(run._is_calibration() for run in runs)
+
+        with tests.temporary_directory() as tmpdir:
+            cache = os.path.join(tmpdir, 'cache.json')
+            args = ('-p2', '-n2', '-w0', '--calibration-cache', cache)
+
+            # empty cache: calibrate and store loops
+            suite, workers = self.run_master(*args)
+            self.assertTrue(is_calibrated(suite))
+            with open(cache) as fp:
+                loops = list(json.load(fp).values())
+            self.assertEqual(loops, [FAKE_CALIBRATED_LOOPS])
+
+            # reuse cached loops: no calibration worker
+            suite, workers = self.run_master(*args)
+            self.assertFalse(is_calibrated(suite))
+            bench = suite.get_benchmark('bench')
+            self.assertEqual(bench.get_nrun(), 2)
+            self.assertEqual(bench.get_runs()[0]._get_loops(), loops[0])
+
+            # cached loops out of tolerance: recalibrate
+            with open(cache) as fp:
+                data = json.load(fp)
+            with open(cache, 'w') as fp:
+                json.dump({key: 1 for key in data}, fp)
+            suite, workers = self.run_master(*args)
+            self.assertTrue(is_calibrated(suite))
+            self.assertEqual(suite.get_benchmark('bench').get_nrun(), 3)
+
+    def test_calibration_cache_invalid(self):
+        with tests.temporary_directory() as tmpdir:
+            cache = os.path.join(tmpdir, 'cache.json')
+            runner = perf.Runner()
+            runner.parse_args(['--calibration-cache', cache])
+            key = runner._calibration_cache_key('bench')
+
+            # truncated file: ignore the cache and recalibrate
+            with open(cache, 'w') as fp:
+                fp.write('{"bench": ')
+            with tests.capture_stdout() as stdout:
+                self.assertIsNone(runner._get_cached_loops(key))
+            self.assertIn('WARNING: ignore invalid calibration cache',
+                          stdout.getvalue())
+
+            # the cache is replaced, no temporary file is left
+            with tests.capture_stdout() as stdout:
+                runner._set_cached_loops(key, 8)
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertEqual(os.listdir(tmpdir), ['cache.json'])
+            self.assertEqual(runner._get_cached_loops(key), 8)
+
+            # invalid number of loops
+            with open(cache, 'w') as fp:
+                json.dump({key: "8"}, fp)
+            self.assertIsNone(runner._get_cached_loops(key))
+
+    def test_time_budget(self):
+        # each worker takes 100 ms
+        suite, workers = self.run_master('-p5', '-n1', '-w0', '-l1',
+                                         '--time-budget=0.3',
+                                         names=('bench1', 'bench2', 'bench3'))
+
+        # the budget is too short to run more than one worker per benchmark
+        self.assertEqual(suite.get_benchmark_names(),
+                         ['bench1', 'bench2', 'bench3'])
+        for bench in suite:
+            self.assertEqual(bench.get_nrun(), 1)
+            self.assertEqual(bench.get_metadata()['stop_reason'],
+                             'time_budget')
+
+    def test_script_eta(self):
+        runner = perf.Runner()
+        runner.parse_args(['--eta'])
+        runner._worker_task = 1
+        runner._bench_durations.append(2.0)
+        with mock.patch.object(runner, '_count_tasks', return_value=5):
+            # current benchmark: 1 sec, then 3 benchmarks of 2 sec
+            self.assertEqual(runner._get_script_eta(1.0), 7.0)
+
+    def test_plan(self):
+        runs = [perf.Run([1.0], metadata={'name': 'bench', 'duration': 1.0},
+                         collect_metadata=False),
+                perf.Run([1.0], metadata={'name': 'bench', 'duration': 2.0},
+                         collect_metadata=False)]
+        suite = perf.BenchmarkSuite([perf.Benchmark(runs)])
+
+        with tests.temporary_file() as tmp_name:
+            suite.dump(tmp_name)
+            runner = perf.Runner()
+            runner.parse_args(['--plan', tmp_name, '-p4'])
+
+            with mock.patch('perf._runner.atexit.register') as register:
+                with tests.capture_stdout() as stdout:
+                    self.assertIsNone(runner.bench_func('bench', None))
+                    self.assertIsNone(runner.timeit('missing', 'pass'))
+                    runner._display_plan()
+        self.assertEqual(register.call_count, 1)
+
+        expected = textwrap.dedent('''
+            bench: 6.0 sec
+            missing: unknown duration
+
+            Estimated duration: 6.0 sec (2 benchmarks)
+            WARNING: 1 benchmark not found in %s
+        ''' % tmp_name).strip()
+        self.assertEqual(stdout.getvalue().rstrip(), expected)
+
+    def test_count_tasks(self):
+        runner = perf.Runner()
+        runner._cpu_affinity = lambda: None
+        rpipe, wpipe = os.pipe()
+        runner.parse_args(['--worker', '--count-tasks', '--pipe', str(wpipe)])
+
+        calls = []
+        for name in ('bench1', 'bench2'):
+            runner.bench_func(name, calls.append)
+        runner.bench_threaded_func('threads', calls.append, threads=3)
+        runner._write_task_count()
+
+        with os.fdopen(rpipe) as rfile:
+            self.assertEqual(json.load(rfile), {'tasks': 5})
+        self.assertEqual(calls, [])
+
+    def test_fork(self):
+        # run the code of the forked child process in the current process
+        runner = perf.Runner()
+        runner._cpu_affinity = lambda: None
+        runner.metadata['master_pid'] = os.getpid()
+        runner.parse_args(['--fork', '-p3', '-n2', '-w0', '-l1'])
+        runner._fork_task = ('bench', lambda loops: 1.0, None, None)
+
+        rpipe, wpipe = pipe_cloexec()
+        if six.PY3:
+            rfile = open(rpipe, "r", encoding="utf8")
+        else:
+            rfile = os.fdopen(rpipe, "r")
+        with rfile:
+            # the worker writes its result and closes the pipe
+            runner._run_forked_worker(False, wpipe)
+            bench_json = rfile.read()
+
+        bench = _load_suite_from_pipe(bench_json).get_benchmark('bench')
+        self.assertEqual(bench.get_samples(), (1.0, 1.0))
+        metadata = bench.get_metadata()
+        self.assertEqual(metadata['worker_mode'], 'fork')
+        # the child process inherits metadata of the master process
+        self.assertEqual(metadata['master_pid'], os.getpid())
+
+        # fork and spawn runs must not be mixed
+        run = bench.get_runs()[0]._update_metadata({'worker_mode': 'spawn'})
+        with self.assertRaises(ValueError):
+            bench.add_run(run)
+
+    def run_outliers(self, outlier, *args):
+        def sample_func(process):
+            # the outlier process is 30% slower
+            if process == outlier:
+                return 1.3
+            return 1.0 + process * 0.001
+
+        suite, workers = self.run_master('-p6', '-n2', '-w0', '-l1', *args,
+                                         sample_func=sample_func)
+        return suite.get_benchmark('bench')
+
+    def test_replace_outliers(self):
+        bench = self.run_outliers(4, '--replace-outliers')
+
+        # 6 runs + 1 replacement run
+        self.assertEqual(bench.get_nrun(), 7)
+        self.assertEqual(bench.get_metadata()['outlier_processes'], 1)
+        flagged = [run for run in bench.get_runs()
+                   if 'outlier_score' in run.get_metadata()]
+        self.assertEqual(len(flagged), 1)
+        self.assertEqual(flagged[0].samples, (1.3, 1.3))
+
+        bench._remove_outlier_processes()
+        self.assertEqual(bench.get_nrun(), 6)
+
+    def test_detect_outliers_first_runs(self):
+        # the first runs are checked once enough runs are available
+        bench = self.run_outliers(2, '--detect-outliers')
+
+        self.assertEqual(bench.get_nrun(), 6)
+        self.assertEqual(bench.get_metadata()['outlier_processes'], 1)
+        flagged = [index for index, run in enumerate(bench.get_runs())
+                   if 'outlier_score' in run.get_metadata()]
+        self.assertEqual(flagged, [1])
+
+    def test_benchmark_filter(self):
+        runner = perf.Runner()
+        runner.parse_args(['--worker', '-l1', '-w0', '-n1',
+                           '--benchmark', '^text_', '--exclude', 'abd'])
+
+        names = ('text_abc', 'text_abd', 'text_xyz', 'json_abc')
+        with tests.capture_stdout():
+            benchmarks = [runner.bench_sample_func(name, lambda loops: 1.0)
+                          for name in names]
+        self.assertEqual([bench.get_name() for bench in benchmarks
+                          if bench is not None],
+                         ['text_abc', 'text_xyz'])
+
+    def test_sched(self):
+        runner = perf.Runner()
+        runner.parse_args(['--sched=idle', '--nice=5'])
+        cmd = runner._worker_cmd(False, 3)
+        self.assertIn('--sched=idle', cmd)
+        self.assertIn('--nice=5', cmd)
+
+        runner = perf.Runner()
+        runner.parse_args(['--worker', '--sched=idle', '--nice=5'])
+        metadata = {}
+        with mock.patch('perf._runner.set_scheduler',
+                        return_value=None) as set_scheduler:
+            with mock.patch('perf._runner.set_nice',
+                            return_value=None) as set_nice:
+                with mock.patch('perf._runner.get_scheduler',
+                                return_value='idle'):
+                    with mock.patch('perf._runner.get_nice',
+                                    return_value=5):
+                        runner._set_scheduling(metadata)
+        set_scheduler.assert_called_once_with('idle')
+        set_nice.assert_called_once_with(5)
+        self.assertEqual(metadata,
+                         {'sched_policy': 'idle', 'nice': 5,
+                          'mlock': 'disabled'})
+
+    @unittest.skipUnless(sys.platform.startswith('linux'),
+                         'mlockall() is only supported on Linux')
+    def test_mlock_limit(self):
+        runner = perf.Runner()
+        runner.parse_args(['--worker', '--mlock'])
+
+        # don't lock future pages under a limited RLIMIT_MEMLOCK
+        limit = (64 * 1024, 64 * 1024)
+        metadata = {}
+        with mock.patch('resource.getrlimit', return_value=limit):
+            with mock.patch('os.geteuid', return_value=1000):
+                with tests.capture_stdout() as stdout:
+                    runner._set_scheduling(metadata)
+        self.assertEqual(metadata['mlock'], 'disabled')
+        self.assertIn('WARNING: unable to lock the memory: RLIMIT_MEMLOCK '
+                      'is limited to 64.0 kB', stdout.getvalue())
+
+    def test_hook(self):
+        result = self.exec_runner('--worker',
+                                  '--hook=perf.tests.test_runner:CountHook',
+                                  '-n3', '-w1', '-l1')
+        metadata = result.bench.get_runs()[0].get_metadata()
+        self.assertEqual(metadata['hook_runs'], 1)
+        # warmups are ignored
+        self.assertEqual(metadata['hook_samples'], 3)
+        self.assertEqual(metadata['hook_loops'], 6)
+        self.assertEqual(metadata['loops'], 1)
+
+    def test_hook_error(self):
+        runner = perf.Runner()
+        with tests.capture_stdout() as stdout:
+            with self.assertRaises(SystemExit):
+                runner.parse_args(['--hook=perf_missing_module'])
+        self.assertIn('ERROR: unable to load the hook perf_missing_module: '
+                      'hook name must be formatted as MODULE:CLASS',
+                      stdout.getvalue())
+
+    def test_randomize_env(self):
+        runner = perf.Runner()
+        runner.parse_args(['--randomize-env'])
+        self.assertIn('--randomize-env', runner._worker_cmd(False, 3))
+
+        # the worker stores the size of the environment padding
+        with mock.patch.dict(os.environ, {ENV_PADDING_VAR: 'x' * 7}):
+            result = self.exec_runner('--worker', '--randomize-env')
+        self.assertEqual(result.bench.get_metadata()['env_padding'], 7)
+
+    def test_cold_start(self):
+        # a single CPU: cold start workers are not run in parallel
+        suite, workers = self.run_master('--cold-start', '--affinity=0',
+                                         '-p2', '-n3', '-w1', '-l4')
+        self.assertEqual(suite.get_benchmark_names(),
+                         ['bench', 'bench (cold start)'])
+        self.assertEqual(suite.get_benchmark('bench').get_nrun(), 2)
+
+        # one process per sample of the steady-state benchmark
+        cold = suite.get_benchmark('bench (cold start)')
+        self.assertEqual(cold.get_nrun(), 6)
+        self.assertEqual(cold.get_metadata()['cold_start'], 'bench')
+        for run in cold.get_runs():
+            self.assertEqual(len(run.samples), 1)
+            self.assertEqual(run.warmups, ())
+            self.assertEqual(run._get_loops(), 1)
+
+    def test_cold_start_pool(self):
+        suite, workers = self.run_master('--cold-start', '--pool',
+                                         '--affinity=0',
+                                         '-p2', '-n2', '-w0', '-l1')
+        self.assertEqual(suite.get_benchmark('bench').get_nrun(), 2)
+        self.assertEqual(suite.get_benchmark('bench (cold start)').get_nrun(),
+                         4)
+        # cold start workers are fresh processes, not pool workers
+        self.assertEqual(workers,
+                         [('pool', False)] * 2 + [('spawn', False)] * 4)
+
+    def test_interleave(self):
+        suite = self.run_script('--interleave', '-p3', '-n1', '-w0')
+        self.assertEqual(suite.get_benchmark_names(), ['bench1', 'bench2'])
+
+        pids = []
+        for bench in suite:
+            # calibration run + 3 runs
+            self.assertEqual(bench.get_nrun(), 4)
+            pids.append([run.get_metadata()['worker_pid']
+                         for run in bench.get_runs()])
+        # each worker process ran the two benchmarks
+        self.assertEqual(pids[0], pids[1])
+        self.assertEqual(len(set(pids[0])), 4)
+
+    def test_interleave_fork(self):
+        runner = perf.Runner()
+        with tests.capture_stdout() as stdout:
+            with self.assertRaises(SystemExit):
+                runner.parse_args(['--interleave', '--fork'])
+        self.assertIn('ERROR: --fork is incompatible with --pool, --jobs, '
+                      '--interleave and --randomize-env',
+                      stdout.getvalue())
+
+    def test_interleave_incompatible(self):
+        for option in ('--detect-outliers', '--replace-outliers',
+                       '--calibration-cache=cache.json', '--eta'):
+            runner = perf.Runner()
+            with tests.capture_stdout() as stdout:
+                with self.assertRaises(SystemExit):
+                    runner.parse_args(['--interleave', option])
+            self.assertIn('ERROR: --interleave is incompatible with',
+                          stdout.getvalue())
+
+    def test_pool(self):
+        suite = self.run_script('--pool', '-p2', '-w0', '-n1',
+                                '--min-time=0.001')
+
+        pids = []
+        for bench in suite:
+            # the calibration run is spawned outside the pool
+            runs = [run for run in bench.get_runs()
+                    if not run._is_calibration()]
+            self.assertEqual(len(runs), 2)
+            pids.append([run.get_metadata()['worker_pid'] for run in runs])
+        # pool workers run the two benchmarks
+        self.assertEqual(pids[0], pids[1])
+
+    def test_pool_max_tasks(self):
+        runner = perf.Runner()
+        runner.parse_args(['--pool', '--max-tasks-per-worker=1',
+                           '-p2', '-n1', '-w0', '-l1', '-q'])
+
+        workers = []
+
+        class PoolWorker(object):
+            def __init__(self):
+                self.ntask = 0
+                self.stopped = False
+                workers.append(self)
+
+            def run_task(self, command, read_stream):
+                self.ntask += 1
+                run = perf.Run([1.0], metadata={'name': 'bench',
+                                                'loops': command['loops']},
+                               collect_metadata=False)
+                return tests.benchmark_as_json(perf.Benchmark([run]))
+
+            def stop(self):
+                self.stopped = True
+
+        with mock.patch.object(runner, '_spawn_pool_worker', PoolWorker):
+            for task in range(2):
+                runner._worker_task = task
+                bench = runner._spawn_workers()
+                self.assertEqual(bench.get_nrun(), 2)
+
+        # each worker runs a single task
+        self.assertEqual(len(workers), 4)
+        self.assertTrue(all(worker.stopped for worker in workers))
+
+    def test_stall_timeout(self):
+        runner = perf.Runner()
+        runner.parse_args(['--stall-timeout=0.5'])
+
+        # the worker writes nothing
+        reader = mock.Mock()
+        reader.readline.return_value = None
+        with self.assertRaises(RuntimeError) as cm:
+            runner._read_stream(reader)
+        self.assertEqual(str(cm.exception),
+                         'worker stalled: no event since 500 ms '
+                         '(0 calibrations, 0 warmups, 0 samples received)')
+        reader.readline.assert_called_once_with(0.5)
+
+    def test_stream_divergence(self):
+        runner = perf.Runner()
+        runner.parse_args(['--stream'])
+
+        def read_stream(*events):
+            lines = [json.dumps(event) + '\n' for event in events]
+            lines.append('{"benchmarks": []}\n')
+            reader = mock.Mock()
+            reader.readline.side_effect = lines
+            return runner._read_stream(reader)
+
+        sample1 = {'event': 'sample', 'index': 1, 'loops': 8,
+                   'raw_sample': 1.0}
+        self.assertEqual(read_stream(sample1), '{"benchmarks": []}\n')
+
+        sample2 = dict(sample1, index=2, raw_sample=float('inf'))
+        with self.assertRaises(RuntimeError) as cm:
+            read_stream(sample1, sample2)
+        self.assertIn('worker diverged: invalid raw sample in sample 2',
+                      str(cm.exception))
+
+        sample2 = dict(sample1, index=2, loops=16)
+        with self.assertRaises(RuntimeError) as cm:
+            read_stream(sample1, sample2)
+        self.assertIn('worker diverged: sample 2 uses 16 loops',
+                      str(cm.exception))
+
+    def test_stream_partial_run(self):
+        runner = perf.Runner()
+        runner.parse_args(['--stream', '--stall-timeout=5', '-v'])
+
+        start = {'event': 'start',
+                 'metadata': {'name': 'bench', 'inner_loops': 2}}
+        warmup = {'event': 'warmup', 'index': 1, 'loops': 8,
+                  'raw_sample': 1.6}
+        sample = {'event': 'sample', 'index': 1, 'loops': 8,
+                  'raw_sample': 1.6}
+        reader = mock.Mock()
+        # the worker stalls after its first sample
+        reader.readline.side_effect = [json.dumps(start) + '\n',
+                                       json.dumps(warmup) + '\n',
+                                       json.dumps(sample) + '\n',
+                                       None]
+        stream_run = perf._runner._StreamRun()
+        with tests.capture_stdout() as stdout:
+            with self.assertRaises(RuntimeError):
+                runner._read_stream(reader, stream_run)
+        # verbose mode: the master displays samples
+        self.assertEqual(stdout.getvalue(), 'Worker sample 1: 100 ms\n')
+
+        run = stream_run.get_run({'cpu': 3})
+        self.assertEqual(run.samples, (0.1,))
+        self.assertEqual(run.warmups, ((8, 1.6),))
+        self.assertEqual(run.get_metadata(),
+                         {'name': 'bench', 'inner_loops': 2, 'loops': 8,
+                          'cpu': 3})
+
+    def test_retry_worker_partial_run(self):
+        runner = perf.Runner()
+        runner.parse_args(['--stream', '-q', '--max-retries=1'])
+
+        run = perf.Run([1.0], metadata={'name': 'bench'},
+                       collect_metadata=False)
+
+        def spawn_worker():
+            raise perf._runner._WorkerError('worker stalled', run)
+
+        suite = runner._retry_worker(spawn_worker)
+        self.assertEqual(suite.get_benchmark('bench').get_runs(), [run])
+        self.assertEqual(runner._failed_processes, ['worker stalled'])
+
 
 class TestRunnerCPUAffinity(unittest.TestCase):
     def test_cpu_affinity_args(self):
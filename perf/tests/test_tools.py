@@ -66,6 +66,15 @@ class TestStatistics(unittest.TestCase):
         #                  (True, -141.4213562373095))
         pass
 
+    def test_median_confidence_interval(self):
+        # not enough samples
+        self.assertIsNone(utils.median_confidence_interval(range(7)))
+
+        self.assertEqual(utils.median_confidence_interval(range(1, 11)),
+                         (1, 10))
+        self.assertEqual(utils.median_confidence_interval(range(1, 101)),
+                         (40, 61))
+
 
 class TestUtils(unittest.TestCase):
     def test_parse_iso8601(self):
@@ -211,6 +220,29 @@ class CPUToolsTests(unittest.TestCase):
         with mock.patch(BUILTIN_OPEN, side_effect=IOError):
             self.assertIsNone(cpu_utils.get_isolated_cpus())
 
+    def test_select_sibling_free_cpus(self):
+        # 4 physical cores with 2 hyperthreads: (0, 4), (1, 5), (2, 6), (3, 7)
+        def get_cpu_siblings(cpu):
+            return sorted((cpu % 4, cpu % 4 + 4))
+
+        def select(cpus, ncpu, allow_siblings=False):
+            with mock.patch('perf._cpu_utils.get_cpu_siblings',
+                            side_effect=get_cpu_siblings):
+                return cpu_utils.select_sibling_free_cpus(cpus, ncpu,
+                                                          allow_siblings)
+
+        self.assertEqual(select([2, 3, 6, 7], 2), [2, 3])
+        self.assertEqual(select(range(8), 3), [0, 1, 2])
+        # duplicated CPUs
+        self.assertEqual(select([2, 2, 3], 2), [2, 3])
+        self.assertIsNone(select([2, 2], 2))
+        # not enough physical cores
+        self.assertIsNone(select([2, 3, 6, 7], 3))
+        self.assertEqual(select([2, 3, 6, 7], 3, allow_siblings=True),
+                         [2, 3, 6])
+        # not enough CPUs
+        self.assertIsNone(select([2, 3, 6, 7], 5, allow_siblings=True))
+
 
 class MiscTests(unittest.TestCase):
     def test_format_metadata(self):
@@ -261,6 +293,20 @@ class MiscTests(unittest.TestCase):
         self.assertRaises(ValueError, parse_run_list, 'x')
         self.assertRaises(ValueError, parse_run_list, '1,')
 
+    def test_create_environ_randomize(self):
+        env = utils.create_environ(None, False)
+        self.assertNotIn('PYTHONHASHSEED', env)
+        self.assertNotIn(utils.ENV_PADDING_VAR, env)
+
+        with mock.patch('perf._utils.random.randint',
+                        side_effect=[123, 5]) as randint:
+            env = utils.create_environ(None, False, randomize=True)
+        self.assertEqual(env['PYTHONHASHSEED'], '123')
+        self.assertEqual(env[utils.ENV_PADDING_VAR], 'xxxxx')
+        # PYTHONHASHSEED=0 would disable hash randomization
+        self.assertEqual(randint.call_args_list[0],
+                         mock.call(1, utils.MAX_HASH_SEED))
+
     def test_setup_version(self):
         import setup
         self.assertEqual(perf.__version__, setup.VERSION)